@@ -0,0 +1,166 @@
+"""Client performance against the mock workspace API.
+
+For every fleet size a MockAPI is started in-process and the client is pointed
+at it through a temporary home directory. Reported per fleet size:
+
+- list: time to list all workspaces, and to the first workspace
+- actions: pause/resume calls per second through Action
+- refresh: a Controller refresh (listing merged into the TUI state, without
+  drawing), cold and when every page revalidates with a 304
+
+    python benchmarks/bench_api.py --fleet 10 100 1000 5000 --latency 0.02
+    python benchmarks/bench_api.py --baseline api.json --update-baseline
+
+With --baseline the run fails (exit status 1) when a metric is more than
+--tolerance worse than the stored value.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_startup import SRC, make_home
+from mock_api import MockAPI
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench_fleet(size: int, args) -> dict:
+    from surf_controller.api import Action, Workspace
+    from surf_controller.client import Client
+    from surf_controller.gui import Controller
+
+    server = MockAPI(
+        fleet=size,
+        latency=args.latency,
+        jitter=args.jitter,
+        page_size=args.page_size,
+        transition=0.0,
+        error_rate_400=args.error_rate_400,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+    ).start()
+    make_home(Path.home(), 0, server.url, ttl=0)
+    try:
+        client = Client(pool_size=max(args.concurrency, 10))
+        workspace = Workspace(client=client)
+
+        def first_row():
+            next(iter(workspace.iter_workspaces()), None)
+
+        list_times = [timed(workspace.get_workspaces) for _ in range(args.runs)]
+        first_times = [timed(first_row) for _ in range(args.runs)]
+        vms = workspace.get_workspaces()[: args.max_actions]
+
+        action = Action(concurrency=args.concurrency, client=client)
+        start = time.perf_counter()
+        results = []
+        for do in ("pause", "resume"):
+            # only call the workspaces that are in the other state
+            targets = [vm for vm in vms if vm.active == (do == "pause")]
+            results += action(do, targets)
+        actions_elapsed = time.perf_counter() - start
+
+        controller = Controller()
+
+        def refresh():
+            controller.refresh()
+            while controller.loading:
+                controller.worker.drain()
+                time.sleep(0.001)
+
+        cold = timed(refresh)
+        revalidate = [timed(refresh) for _ in range(args.runs)]
+    finally:
+        server.stop()
+
+    ok = sum(result.ok for result in results)
+    return {
+        "list_s": statistics.median(list_times),
+        "first_row_s": statistics.median(first_times),
+        "actions_per_s": len(results) / actions_elapsed if results else 0.0,
+        "actions_failed": len(results) - ok,
+        "refresh_cold_s": cold,
+        "refresh_revalidate_s": statistics.median(revalidate),
+        "requests": dict(server.requests),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None or not isinstance(value, float):
+                continue
+            higher_is_better = name.endswith("per_s")
+            worse = value < before * (1 - tolerance) if higher_is_better else value > before * (1 + tolerance)
+            if worse:
+                regressions.append(f"{size} workspaces: {name} {before:.4f} -> {value:.4f}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fleet", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--error-rate-400", type=float, default=0.0)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-actions", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The client finds its config in the home directory, so this has to be
+        # in place before surf_controller is imported
+        os.environ["HOME"] = tmp
+        sys.path.insert(0, str(SRC))
+        from surf_controller.utils import setup_logger
+
+        setup_logger()
+        results = {}
+        print(
+            f"{'fleet':>6} {'list':>9} {'1st row':>9} {'actions/s':>10} "
+            f"{'failed':>7} {'refresh':>9} {'304 refr.':>9}"
+        )
+        for size in args.fleet:
+            metrics = bench_fleet(size, args)
+            results[str(size)] = metrics
+            print(
+                f"{size:>6} {metrics['list_s'] * 1000:>7.1f}ms {metrics['first_row_s'] * 1000:>7.1f}ms "
+                f"{metrics['actions_per_s']:>10.1f} {metrics['actions_failed']:>7} "
+                f"{metrics['refresh_cold_s'] * 1000:>7.1f}ms {metrics['refresh_revalidate_s'] * 1000:>7.1f}ms"
+            )
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    failed = False
+    if args.baseline and args.baseline.exists() and not args.update_baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        failed = bool(regressions)
+    if args.baseline and args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"baseline written to {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
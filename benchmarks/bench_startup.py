@@ -0,0 +1,135 @@
+"""Cold start of the TUI until the first frame with workspace rows is drawn.
+
+Every run starts a fresh interpreter on a pseudo terminal, with a temporary
+home directory that holds tokens and a fresh listing cache, so no request is
+made before the first frame. Exits with status 1 when the median start-up time
+is over budget or more than `--tolerance` slower than a stored baseline.
+
+    python benchmarks/bench_startup.py --runs 10 --budget 1.0
+    python benchmarks/bench_startup.py --baseline startup.json --update-baseline
+"""
+import argparse
+import fcntl
+import json
+import os
+import pty
+import select
+import signal
+import statistics
+import struct
+import sys
+import tempfile
+import termios
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+
+def make_home(home: Path, fleet: int, url: str, ttl: int = 3600) -> None:
+    """Fill `home` with the files the controller needs to start without prompting."""
+    scriptdir = home / ".surf_controller"
+    scriptdir.mkdir(parents=True, exist_ok=True)
+    (scriptdir / "api-token.txt").write_text("token")
+    (scriptdir / "csrf-token.txt").write_text("csrf")
+    (scriptdir / "username.txt").write_text("")
+    (scriptdir / "config.toml").write_text(
+        # The governor would pace the mock at the gateway's rate
+        f'[surf]\nURL = "{url}"\n\n[cache]\nttl = {ttl}\n\n[governor]\nrate = 0\n'
+    )
+    results = [
+        {
+            "id": f"ws-{i:05d}",
+            "name": f"bench-vm-{i:05d}",
+            "active": i % 2 == 0,
+            "resource_meta": {"ip": f"10.0.{i // 250}.{i % 250}"},
+        }
+        for i in range(fleet)
+    ]
+    cache = {
+        "fetched_at": time.time(),
+        "pages": {"bench": {"etag": None, "last_modified": None, "data": {"results": results}}},
+    }
+    (scriptdir / "workspaces.json").write_text(json.dumps(cache))
+
+
+def time_to_marker(
+    home: Path, marker: bytes, keys: bytes = b"", timeout: float = 30.0
+) -> float:
+    """Start the TUI in a pty, send `keys`, and time until `marker` is on screen."""
+    start = time.perf_counter()
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ.update(
+            HOME=str(home), TERM="xterm", PYTHONPATH=str(SRC), PYTHONDONTWRITEBYTECODE="1"
+        )
+        os.execvp(
+            sys.executable,
+            [sys.executable, "-c", "from surf_controller.gui import main; main()"],
+        )
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", 50, 120, 0, 0))
+    if keys:
+        os.write(fd, keys)
+    output = b""
+    elapsed = None
+    try:
+        while time.perf_counter() - start < timeout:
+            ready, _, _ = select.select([fd], [], [], 0.01)
+            if not ready:
+                continue
+            try:
+                output += os.read(fd, 65536)
+            except OSError:
+                break
+            if marker in output:
+                elapsed = time.perf_counter() - start
+                break
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        os.close(fd)
+    if elapsed is None:
+        raise RuntimeError(f"{marker!r} did not appear within {timeout}s")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fleet", type=int, default=500, help="workspaces in the cache")
+    parser.add_argument("--budget", type=float, default=1.5, help="max median seconds")
+    parser.add_argument("--baseline", type=Path, help="JSON file with an earlier median")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        home = Path(tmp)
+        # nothing listens on port 9, the cache is fresh so it is never asked
+        make_home(home, args.fleet, "http://127.0.0.1:9/v1/workspace/workspaces")
+        times = [time_to_marker(home, b"bench-vm-00000") for _ in range(args.runs)]
+
+    median = statistics.median(times)
+    print(
+        f"first frame: median {median * 1000:.0f}ms, "
+        f"min {min(times) * 1000:.0f}ms, max {max(times) * 1000:.0f}ms "
+        f"({args.runs} runs, {args.fleet} workspaces)"
+    )
+
+    failed = False
+    if median > args.budget:
+        print(f"FAIL: median is over the budget of {args.budget * 1000:.0f}ms")
+        failed = True
+    if args.baseline and args.baseline.exists() and not args.update_baseline:
+        baseline = json.loads(args.baseline.read_text())["median"]
+        if median > baseline * (1 + args.tolerance):
+            print(f"FAIL: regressed from the baseline of {baseline * 1000:.0f}ms")
+            failed = True
+    if args.baseline and args.update_baseline:
+        args.baseline.write_text(json.dumps({"median": median}))
+        print(f"baseline written to {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
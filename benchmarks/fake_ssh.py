@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Stand-in for `ssh` to try the ssh fan-out without real hosts.
+
+Takes the same command line as ssh, waits a while as if it logged in, prints
+a few lines for the host and exits with a status derived from the IP address.
+
+    [ssh]
+    binary = "/path/to/benchmarks/fake_ssh.py"
+
+FAKE_SSH_LATENCY sets the seconds per session (default 0.2), FAKE_SSH_FAIL
+makes every host whose last IP octet is divisible by it exit with status 1
+(default 7, 0 disables).
+"""
+import os
+import sys
+import time
+
+# ssh options that take a value
+WITH_VALUE = set("BbcDEeFIiJLlmOopQRSWw")
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option[1:] and option[-1] in WITH_VALUE and len(option) == 2:
+            args.pop(0)
+    if not args:
+        print("usage: fake_ssh.py [options] host [command]", file=sys.stderr)
+        return 255
+    host, command = args[0], " ".join(args[1:])
+
+    time.sleep(float(os.environ.get("FAKE_SSH_LATENCY", 0.2)))
+    print(f"fake session on {host}")
+    print(f"$ {command}")
+    sys.stdout.flush()
+    time.sleep(float(os.environ.get("FAKE_SSH_LATENCY", 0.2)) / 2)
+    print("/dev/sda1  100G  42G  58G  42% /")
+
+    fail = int(os.environ.get("FAKE_SSH_FAIL", 7))
+    octet = int(host.rsplit(".", 1)[-1]) if host.rsplit(".", 1)[-1].isdigit() else 1
+    if fail and octet % fail == 0:
+        print("command failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""Local stand-in for the SURF workspace API.
+
+Serves the workspace listing (with limit/offset pagination, next links, ETags
+and a name__icontains filter), single workspaces and the pause/resume actions
+for a generated fleet. Latency and error responses can be injected to see how
+the client behaves under load, and --rate-limit answers 429 to the requests
+over that many per second, like a rate-limited gateway. With --accounts N the
+fleet is split over the tokens "account-0" .. "account-<N-1>": every token
+sees its own share of the fleet plus every tenth workspace, which all tokens
+share, and can only act on what it sees.
+
+    python benchmarks/mock_api.py --fleet 1000 --latency 0.05 --error-rate-429 0.05
+
+Point `[surf] URL` in the config at the printed URL to use it with the
+controller.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+PREFIX = "/v1/workspace/workspaces"
+ITEM = re.compile(rf"^{PREFIX}/([^/]+)/$")
+ACTION = re.compile(rf"^{PREFIX}/([^/]+)/actions/(pause|resume)/$")
+
+
+def make_fleet(size: int) -> dict:
+    return {
+        f"ws-{i:05d}": {
+            "id": f"ws-{i:05d}",
+            "name": f"mock-{['alice', 'bob', 'carol'][i % 3]}-{i:05d}",
+            "active": i % 2 == 0,
+            "resource_meta": {"ip": f"10.{i // 62500}.{i // 250 % 250}.{i % 250}"},
+        }
+        for i in range(size)
+    }
+
+
+class MockAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        fleet: int = 100,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        page_size: Optional[int] = None,
+        transition: float = 1.0,
+        error_rate_400: float = 0.0,
+        error_rate_429: float = 0.0,
+        error_rate_5xx: float = 0.0,
+        retry_after: int = 1,
+        rate_limit: float = 0.0,
+        accounts: int = 0,
+        seed: int = 0,
+        port: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.fleet = make_fleet(fleet)
+        self.order = list(self.fleet)
+        self.accounts = accounts
+        self.latency = latency
+        self.jitter = jitter
+        # the page size the server enforces, whatever limit is asked for
+        self.page_size = page_size
+        self.transition = transition
+        self.error_rates = {400: error_rate_400, 429: error_rate_429, 503: error_rate_5xx}
+        self.retry_after = retry_after
+        # token bucket of `rate_limit` requests per second, one second deep
+        self.rate_limit = rate_limit
+        self.tokens = rate_limit
+        self.refilled = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{PREFIX}"
+
+    def start(self) -> "MockAPI":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def count(self, kind: str) -> None:
+        with self.lock:
+            self.requests[kind] += 1
+
+    def delay(self) -> None:
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def limited(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate_limit, self.tokens + (now - self.refilled) * self.rate_limit
+            )
+            self.refilled = now
+            if self.tokens < 1:
+                self.requests["throttled"] += 1
+                return True
+            self.tokens -= 1
+            return False
+
+    def injected_error(self) -> Optional[int]:
+        if self.limited():
+            return 429
+        with self.lock:
+            roll = self.random.random()
+        for status, rate in self.error_rates.items():
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def visible(self, token: Optional[str]) -> list:
+        """Ids of the workspaces `token` can see, in listing order."""
+        if not self.accounts:
+            return self.order
+        if not token or not token.startswith("account-"):
+            return []
+        account = int(token.rsplit("-", 1)[-1])
+        return [
+            ws_id
+            for i, ws_id in enumerate(self.order)
+            if i % self.accounts == account or i % 10 == 0
+        ]
+
+    def settle(self, workspace: dict, active: bool) -> None:
+        def flip():
+            workspace["active"] = active
+
+        timer = threading.Timer(self.transition, flip)
+        timer.daemon = True
+        timer.start()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every response
+    # waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+    server: MockAPI
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body=None, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def fail(self, status: int) -> None:
+        headers = {"Retry-After": str(self.server.retry_after)} if status == 429 else {}
+        self.reply(status, {"code": status, "message": "injected error"}, headers)
+
+    def do_GET(self):
+        self.server.delay()
+        url = urlparse(self.path)
+        error = self.server.injected_error()
+        if error and error != 400:
+            return self.fail(error)
+
+        visible = self.server.visible(self.headers.get("authorization"))
+        match = ITEM.match(url.path)
+        if match:
+            self.server.count("get")
+            workspace = self.server.fleet.get(match.group(1))
+            if workspace is None or match.group(1) not in visible:
+                return self.reply(404, {})
+            return self.reply(200, workspace)
+        if url.path.rstrip("/") != PREFIX:
+            return self.reply(404, {})
+
+        self.server.count("list")
+        query = parse_qs(url.query)
+        limit = int(query.get("limit", ["100"])[0])
+        if self.server.page_size:
+            limit = min(limit, self.server.page_size)
+        offset = int(query.get("offset", ["0"])[0])
+        search = query.get("name__icontains", [""])[0].lower()
+        if search:
+            visible = [i for i in visible if search in self.server.fleet[i]["name"].lower()]
+        ids = visible[offset : offset + limit]
+        next_url = None
+        if offset + limit < len(visible):
+            rest = {k: v[0] for k, v in query.items() if k not in ("limit", "offset")}
+            params = "&".join(f"{k}={v}" for k, v in rest.items())
+            next_url = (
+                f"http://{self.headers['Host']}{url.path}?{params}&limit={limit}"
+                f"&offset={offset + limit}"
+            )
+        body = {
+            "count": len(visible),
+            "next": next_url,
+            "results": [self.server.fleet[i] for i in ids],
+        }
+        etag = '"' + hashlib.md5(json.dumps(body).encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.reply(304, headers={"ETag": etag})
+        self.reply(200, body, {"ETag": etag})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.delay()
+        self.server.count("action")
+        error = self.server.injected_error()
+        if error:
+            return self.fail(error)
+        match = ACTION.match(urlparse(self.path).path)
+        workspace = self.server.fleet.get(match.group(1)) if match else None
+        visible = self.server.visible(self.headers.get("authorization"))
+        if workspace is None or match.group(1) not in visible:
+            return self.reply(404, {})
+        active = match.group(2) == "resume"
+        if workspace["active"] == active:
+            return self.reply(400, {"code": 400, "message": "workspace is already in this state"})
+        self.server.settle(workspace, active)
+        self.reply(202, {"id": workspace["id"], "action": match.group(2)})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fleet", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds")
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--transition", type=float, default=1.0, help="seconds to pause/resume")
+    parser.add_argument("--error-rate-400", type=float, default=0.0)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second")
+    parser.add_argument("--accounts", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockAPI(
+        fleet=args.fleet,
+        latency=args.latency,
+        jitter=args.jitter,
+        page_size=args.page_size,
+        transition=args.transition,
+        error_rate_400=args.error_rate_400,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        retry_after=args.retry_after,
+        rate_limit=args.rate_limit,
+        accounts=args.accounts,
+        port=args.port,
+    )
+    print(f"Serving {args.fleet} workspaces at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
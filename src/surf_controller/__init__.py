@@ -1,8 +1,9 @@
-import shutil
 from pathlib import Path
 
 
 def setup_config():
+    import shutil
+
     # Define the user's config directory
     user_config_dir = Path.home() / ".surf_controller"
     user_config_file = user_config_dir / "config.toml"
@@ -18,9 +19,4 @@ def setup_config():
         shutil.copy(default_config, user_config_file)
 
 
-setup_config()
-
 __version__ = "0.3.8"
-print(
-    f"Welcome to surf_controller version {__version__}"
-)
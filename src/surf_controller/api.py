@@ -1,144 +1,534 @@
-import csv
-import curses
 import json
+import queue
 import shutil
 import subprocess
+import threading
 import time
-from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+from urllib.parse import quote
 
-import requests
+from surf_controller.cache import ListingCache
+from surf_controller.client import Client, RequestError, get_client
+from surf_controller.history import get_history
+from surf_controller.metrics import metrics
+from surf_controller.registry import Change, WorkspaceRecord, diff
+from surf_controller.snapshot import Snapshot
+from surf_controller.utils import config, logger, setup_logger
 
-from surf_controller.utils import config, logger
+if TYPE_CHECKING:
+    import curses
+
+
+# The error of a call that was never sent, because its action was stopped
+CANCELLED = "cancelled"
+
+
+@dataclass
+class ActionResult:
+    id: str
+    name: str
+    action: str
+    status_code: Optional[int]
+    latency: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 
 class Action:
-    def __init__(self):
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        client: Optional[Client] = None,
+        clients: Optional[dict[str, Client]] = None,
+    ):
         self.scriptdir = Path.home() / config["files"]["scriptdir"]
         self.URL = config["surf"]["URL"]
-        self.auth_token_file = self.scriptdir / config["files"]["api-token"]
-        if self.auth_token_file.exists():
-            self.AUTH_TOKEN = self.auth_token_file.read_text().strip()
-        else:
-            logger.warning(f"API token not found at {self.auth_token_file}")
-        self.csrf_token_file = self.scriptdir / config["files"]["csrf-token"]
-        if self.csrf_token_file.exists():
-            self.CSRF_TOKEN = self.csrf_token_file.read_text().strip()
-        else:
-            logger.warning(f"CSRF token not found at {self.csrf_token_file}")
+        self.client = client or get_client()
+        # Workspaces listed with an account are called with that account's client
+        self.clients = clients or {}
         self.OUTPUT_FILE = self.scriptdir / config["files"]["ids"]
-
-    def __call__(self, do: str, data: list, id_filter: list):
+        self.concurrency = concurrency or config["action"]["concurrency"]
+        self.stopping = threading.Event()
+
+    def __call__(
+        self, do: str, data: list, ids: Optional[Iterable[str]] = None
+    ) -> list[ActionResult]:
+        return list(self.run(do, data, ids))
+
+    def run(
+        self, do: str, data: list, ids: Optional[Iterable[str]] = None
+    ) -> Iterator[ActionResult]:
+        """Send `do` to every workspace in `data`, or only to those in `ids`.
+
+        Workspaces are matched by id, names are not unique. Calls are spread
+        over a pool of at most `self.concurrency` workers and results are
+        yielded in order of completion.
+        """
+        ids = set(ids) if ids else None
+        targets = []
         for item in data:
-            timestamp = time.strftime("%d-%m-%Y %H:%M:%S")
-            if id_filter and item.name not in id_filter:
+            if ids is not None and item.id not in ids:
                 logger.debug(
-                    f"{timestamp} | {item.name} | {item.id} | active: {item.active} : skipping (not in id_filter)"
+                    "%s | %s | active: %s : skipping (not selected)",
+                    item.name, item.id, item.active,
                 )
                 continue
-
-            logger.info(
-                f"{timestamp} | {item.name} | {item.id} | active: {item.active} : Attempt to {do}..."
+            targets.append(item)
+
+        if targets:
+            workers = min(self.concurrency, len(targets))
+            cancelled = threading.Event()
+            pool = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [pool.submit(self.post, do, item, cancelled) for item in targets]
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                # Reached early when the caller stops iterating (Ctrl-C, a
+                # closed pipe, `break`): the calls not sent yet are dropped
+                cancelled.set()
+                pool.shutdown(cancel_futures=True)
+        logger.info("Finished %s for all workspaces", do)
+
+    def stop(self) -> None:
+        """Skip the calls of running bulk actions that have not been sent yet."""
+        self.stopping.set()
+
+    def post(
+        self, do: str, item, cancelled: Optional[threading.Event] = None
+    ) -> ActionResult:
+        if self.stopping.is_set() or (cancelled and cancelled.is_set()):
+            return ActionResult(item.id, item.name, do, None, 0.0, CANCELLED)
+        # Fields for the JSON log, see `[logging] json`
+        fields = {"workspace_id": item.id, "workspace": item.name, "action": do}
+        logger.info(
+            "%s | %s | active: %s : Attempt to %s...",
+            item.name, item.id, item.active, do, extra=fields,
+        )
+
+        full_url = f"{self.URL}/{item.id}/actions/{do}/"
+        headers = {"Content-Type": f"application/json;{do}"}
+
+        start = time.perf_counter()
+        try:
+            client = self.clients.get(item.account, self.client)
+            response = client.post(full_url, headers=headers, data="{}")
+        except RequestError as e:
+            latency = time.perf_counter() - start
+            logger.warning(
+                "%s | %s | active:%s : Error %s: %s",
+                item.name, item.id, item.active, do, e,
+                extra={**fields, "status": None, "latency": latency, "error": str(e)},
+            )
+            return ActionResult(item.id, item.name, do, None, latency, str(e))
+        latency = time.perf_counter() - start
+
+        if response.status_code >= 400:
+            logger.warning(
+                "%s | %s | active:%s : Error %s: %s",
+                item.name, item.id, item.active, do, response.text,
+                extra={**fields, "status": response.status_code, "latency": latency},
+            )
+            return ActionResult(
+                item.id, item.name, do, response.status_code, latency, response.text
             )
 
-            full_url = f"{self.URL}/{item.id}/actions/{do}/"
-            headers = {
-                "accept": "application/json;Compute",
-                "authorization": self.AUTH_TOKEN,
-                "Content-Type": f"application/json;{do}",
-                "X-CSRFTOKEN": self.CSRF_TOKEN,
-            }
-
-            response = requests.post(full_url, headers=headers, data="{}")
-
-            if response.status_code == 400:
-                logger.warning(
-                    f"{timestamp} | {item.name} | {item.id} | active:{item.active} : Error {do}"
-                )
-                logger.warning(
-                    f"{timestamp} | {item.name} | {item.id} | active:{item.active} : {response.text}"
-                )
-            else:
-                logger.info(
-                    f"{timestamp} | {item.name} | {item.id} | active:{item.active} : Success {do}"
-                )
-        logger.info(f"Finished {do} for all workspaces")
+        logger.info(
+            "%s | %s | active:%s : Success %s",
+            item.name, item.id, item.active, do,
+            extra={**fields, "status": response.status_code, "latency": latency},
+        )
+        return ActionResult(item.id, item.name, do, response.status_code, latency)
+
+
+def watch_changes(
+    fetch: Callable[[], Optional[list]],
+    interval: Optional[float] = None,
+    max_interval: Optional[float] = None,
+    stopping: Optional[threading.Event] = None,
+    known: Optional[Iterable[WorkspaceRecord]] = None,
+) -> Iterator[list[Change]]:
+    """Call `fetch` over and over and yield what changed since the last call.
+
+    `fetch` returns the current listing, or None when it could not be fetched.
+    The first listing comes out as all "added", unless the caller passes the
+    listing it has as `known`: then the first call waits `interval` and only
+    the differences with `known` come out. Without changes the delay grows
+    from `interval` up to `max_interval` seconds, and it drops back to
+    `interval` as soon as something changes. Stops when `stopping` is set.
+    """
+    interval = interval or config["watch"]["interval"]
+    max_interval = max_interval or config["watch"]["max-interval"]
+    stopping = stopping or threading.Event()
+    delay = interval
+    if known is not None:
+        known = {record.id: record for record in known}
+        stopping.wait(delay)
+    else:
+        known = {}
+    while not stopping.is_set():
+        records = fetch()
+        changes = []
+        if records is not None:
+            changes = diff(known, records)
+            known = {record.id: record for record in records}
+        if changes:
+            for change in changes:
+                metrics.inc("surf_watch_changes_total", kind=change.kind)
+            yield changes
+            delay = interval
+        else:
+            delay = min(delay * 1.5, max_interval)
+        stopping.wait(delay)
 
 
 class Workspace:
-    def __init__(self):
+    def __init__(
+        self, client: Optional[Client] = None, cache: Optional[ListingCache] = None
+    ):
         self.scriptdir = Path.home() / config["files"]["scriptdir"]
-        self.URL = config["surf"]["URL"] + "/?application_type=Compute&deleted=false&limit=100"
-        self.auth_token_file = self.scriptdir / config["files"]["api-token"]
-        if self.auth_token_file.exists():
-            self.AUTH_TOKEN = self.auth_token_file.read_text().strip()
-        else:
-            logger.warning(f"API token not found at {self.auth_token_file}")
+        self.client = client or get_client()
+        self.cache = cache
+        self.complete = False
+        self.URL = (
+            config["surf"]["URL"]
+            + f"/?application_type=Compute&deleted=false&limit={config['surf']['page-size']}"
+        )
         self.OUTPUT_FILE = self.scriptdir / config["files"]["ids"]
         self.filter = True
 
-        # Set up the headers for the request
-        self.headers = {
-            "accept": "application/json;Compute",
-            "authorization": self.AUTH_TOKEN,
-        }
+    @property
+    def account(self) -> str:
+        return self.client.account
 
     def get_workspaces(
         self, save: bool = False, username: Optional[str] = None
     ) -> list:
-        # Make the GET request
-        response = requests.get(self.URL, headers=self.headers)
-
-        # Check if the request was successful
+        results = []
+        with self.snapshot() if save else nullcontext() as snapshot:
+            # The snapshot lists every workspace, so the API can't filter
+            for page in self.iter_pages(None if save else username):
+                results.extend(self.parse(page, username, snapshot))
+            if snapshot and self.complete:
+                self.commit(snapshot)
+        return results
+
+    def get_workspace(self, workspace_id: str) -> Optional[WorkspaceRecord]:
+        data = self.fetch_page(f"{config['surf']['URL']}/{workspace_id}/")
+        if data is None:
+            return None
+        return self.parse([data])[0]
+
+    def iter_workspaces(self, username: Optional[str] = None) -> Iterator[WorkspaceRecord]:
+        for page in self.iter_pages(username):
+            yield from self.parse(page, username)
+
+    def watch(
+        self, username: Optional[str] = None, stopping: Optional[threading.Event] = None
+    ) -> Iterator[list[Change]]:
+        """Follow the listing and yield the added, removed and changed
+        workspaces, see `watch_changes`. With a cache, pages that did not
+        change cost a 304 response."""
+
+        def fetch() -> Optional[list]:
+            vms = self.get_workspaces(username=username)
+            return vms if self.complete else None
+
+        return watch_changes(fetch, stopping=stopping)
+
+    def list_url(self, username: Optional[str] = None) -> str:
+        """The first page of the listing, filtered by the API if it can be.
+
+        `[surf] name-filter` names the query parameter the API filters names
+        with; without it every workspace is downloaded and `parse` filters.
+        """
+        param = config["surf"]["name-filter"]
+        if param and self.filter and username:
+            return f"{self.URL}&{param}={quote(username)}"
+        return self.URL
+
+    def iter_pages(self, username: Optional[str] = None) -> Iterator[list]:
+        """Yield the raw results of every page of the workspace listing.
+
+        The request for the next page is sent as soon as the current page has
+        arrived, so it downloads while the caller is handling the current one.
+        With `username`, only its workspaces are requested where the API
+        supports that, see `list_url`.
+        """
+        self.complete = False
+        fetch = self.fetch_cached_page if self.cache else self.fetch_page
+        url = self.list_url(username)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            offset = 0
+            future = pool.submit(fetch, url)
+            while future is not None:
+                data = future.result()
+                if data is None:
+                    return
+                results = data["results"]
+                offset += len(results)
+                next_url = self.next_url(data, offset, url)
+                future = pool.submit(fetch, next_url) if next_url else None
+                yield results
+        self.complete = True
+        if self.cache:
+            self.cache.save()
+
+    def request(self, url: str, headers: Optional[dict] = None):
+        try:
+            return self.client.get(url, headers=headers)
+        except RequestError as e:
+            logger.warning("Failed to fetch data: %s", e)
+            return None
+
+    def fetch_page(self, url: str) -> Optional[dict]:
+        response = self.request(url)
+        if response is None:
+            return None
         if response.status_code == 200:
-            # Parse the JSON response
-            data = response.json()
-            if save:
-                self.save(data)
-
-            results = []
-            Data = namedtuple("Data", ["id", "name", "active", "ip"])
-            for result in data["results"]:
-                meta = result["resource_meta"]
-                if "ip" in meta:
-                    ip = meta["ip"]
-                else:
-                    ip = "Not available"
-                if self.filter and username and username not in result["name"]:
-                    continue
-                results.append(Data(result["id"], result["name"], result["active"], ip))
-            return results
+            with metrics.timer("surf_parse_seconds", stage="json"):
+                return response.json()
+        logger.info("Failed to fetch data. Status code: %s", response.status_code)
+        return None
+
+    def fetch_cached_page(self, url: str) -> Optional[dict]:
+        response = self.request(url, headers=self.cache.validators(url))
+        if response is None:
+            return None
+        if response.status_code == 304:
+            data = self.cache.page(url)
+        elif response.status_code == 200:
+            with metrics.timer("surf_parse_seconds", stage="json"):
+                data = response.json()
         else:
-            logger.info(f"Failed to fetch data. Status code: {response.status_code}")
-            return []
+            logger.info("Failed to fetch data. Status code: %s", response.status_code)
+            return None
+        self.cache.put(url, data, response.headers)
+        return data
+
+    def next_url(self, data: dict, offset: int, url: str) -> Optional[str]:
+        if data.get("next"):
+            return data["next"]
+        # Without a next link, fall back on the total count if there is one
+        count = data.get("count")
+        if data["results"] and count is not None and offset < count:
+            return f"{url}&offset={offset}"
+        return None
+
+    def parse(
+        self,
+        page: list,
+        username: Optional[str] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> list[WorkspaceRecord]:
+        with metrics.timer("surf_parse_seconds", stage="records"):
+            return self.parse_records(page, username, snapshot)
+
+    def parse_records(
+        self,
+        page: list,
+        username: Optional[str] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> list[WorkspaceRecord]:
+        """Turn a page into records, and write every workspace to `snapshot`.
+
+        The snapshot gets all workspaces, the returned records only those
+        that pass the username filter.
+        """
+        if snapshot is None and self.filter and username:
+            page = (result for result in page if username in result["name"])
+        results = []
+        for result in page:
+            record = WorkspaceRecord.from_result(result, self.account)
+            if snapshot is not None:
+                snapshot.write(record.as_dict())
+                if self.filter and username and username not in record.name:
+                    continue
+            results.append(record)
+        return results
+
+    def snapshot(self, fields: Optional[list[str]] = None) -> Snapshot:
+        """Start a new `ids` file, see `parse` and `commit`."""
+        return Snapshot(self.OUTPUT_FILE, fields or list(WorkspaceRecord.FIELDS))
+
+    def commit(self, snapshot: Snapshot) -> None:
+        snapshot.commit()
+        logger.info("Data successfully saved to %s", self.OUTPUT_FILE)
+
+
+class Fleet:
+    """The workspaces of all configured accounts, as one listing.
+
+    Every `[accounts.<name>]` table in the config has its own tokens, client
+    and listing cache; without any the tokens in [files] are used. The
+    accounts are listed at the same time, so a listing takes as long as the
+    slowest account, and a workspace that more than one account can see is
+    only listed once, tagged with the account it came in with first. Actions
+    and polls for a workspace go through the client of that account. Every
+    workspace fetched from the API is recorded in the history store, if one
+    is configured (see `History`).
+    """
+
+    def __init__(self, cache: bool = False, pool_size: Optional[int] = None):
+        self.workspaces: dict[str, Workspace] = {}
+        for account in config.accounts():
+            client = Client(pool_size=pool_size, account=account)
+            listing = None
+            if cache:
+                path = config.scriptdir / config["cache"]["file"]
+                if account:
+                    path = path.with_name(f"{path.stem}-{account}{path.suffix}")
+                listing = ListingCache(path)
+            self.workspaces[account] = Workspace(client=client, cache=listing)
+        self.primary = next(iter(self.workspaces.values()))
+        self.owners: dict[str, Workspace] = {}
+        self.history = get_history()
+
+    @property
+    def clients(self) -> dict[str, Client]:
+        return {account: ws.client for account, ws in self.workspaces.items()}
+
+    @property
+    def fields(self) -> list[str]:
+        """Columns of the `ids` file, with the account if there are several."""
+        fields = list(WorkspaceRecord.FIELDS)
+        return fields + ["account"] if len(self.workspaces) > 1 else fields
+
+    @property
+    def filter(self) -> bool:
+        return self.primary.filter
+
+    @filter.setter
+    def filter(self, value: bool) -> None:
+        for workspace in self.workspaces.values():
+            workspace.filter = value
+
+    @property
+    def complete(self) -> bool:
+        return all(workspace.complete for workspace in self.workspaces.values())
+
+    def fresh(self) -> bool:
+        return all(ws.cache is not None and ws.cache.fresh() for ws in self.workspaces.values())
+
+    def cached(self, username: Optional[str] = None) -> list[WorkspaceRecord]:
+        """The last complete listing of every account, from the caches."""
+        results = []
+        seen: set = set()
+        for workspace in self.workspaces.values():
+            if workspace.cache is not None:
+                page = self.unseen(workspace, workspace.cache.results(), seen)
+                results.extend(workspace.parse(page, username))
+        return results
+
+    def unseen(self, workspace: Workspace, page: list, seen: set) -> list:
+        page = [result for result in page if result["id"] not in seen]
+        for result in page:
+            seen.add(result["id"])
+            self.owners[result["id"]] = workspace
+        return page
+
+    def iter_batches(
+        self, username: Optional[str] = None, snapshot: Optional[Snapshot] = None
+    ) -> Iterator[list[WorkspaceRecord]]:
+        """Yield the records of every page of every account as they arrive.
+
+        Each account is paged through on its own thread; the pages are
+        deduplicated, written to `snapshot` and parsed on the caller's thread.
+        """
+        pages: queue.Queue = queue.Queue()
+        # The snapshot lists every workspace, so the API can't filter
+        remote = username if snapshot is None else None
+
+        def fetch(workspace: Workspace) -> None:
+            try:
+                for page in workspace.iter_pages(remote):
+                    pages.put((workspace, page))
+            except Exception:
+                # The listing stays incomplete, this is the only trace of why
+                logger.exception(
+                    "Failed to list the workspaces of %s",
+                    workspace.account or "the default account",
+                )
+            finally:
+                pages.put((workspace, None))
+
+        seen: set = set()
+        with ThreadPoolExecutor(max_workers=len(self.workspaces)) as pool:
+            for workspace in self.workspaces.values():
+                pool.submit(fetch, workspace)
+            running = len(self.workspaces)
+            while running:
+                workspace, page = pages.get()
+                if page is None:
+                    running -= 1
+                    continue
+                page = self.unseen(workspace, page, seen)
+                records = workspace.parse(page, username, snapshot)
+                if self.history:
+                    self.history.observe(records)
+                yield records
+
+    def iter_workspaces(self, username: Optional[str] = None) -> Iterator[WorkspaceRecord]:
+        for records in self.iter_batches(username):
+            yield from records
+
+    def watch(
+        self, username: Optional[str] = None, stopping: Optional[threading.Event] = None
+    ) -> Iterator[list[Change]]:
+        """`Workspace.watch` over all accounts."""
+
+        def fetch() -> Optional[list]:
+            vms = self.get_workspaces(username=username)
+            return vms if self.complete else None
+
+        return watch_changes(fetch, stopping=stopping)
+
+    def get_workspaces(
+        self, save: bool = False, username: Optional[str] = None
+    ) -> list[WorkspaceRecord]:
+        results = []
+        with self.snapshot() if save else nullcontext() as snapshot:
+            for records in self.iter_batches(username, snapshot):
+                results.extend(records)
+            if snapshot and self.complete:
+                self.commit(snapshot)
+        return results
+
+    def get_workspace(self, workspace_id: str) -> Optional[WorkspaceRecord]:
+        workspace = self.owners.get(workspace_id, self.primary)
+        record = workspace.get_workspace(workspace_id)
+        if record is not None and self.history:
+            # the waiter polls through here, so transitions are timed closely
+            self.history.observe([record])
+        return record
+
+    def snapshot(self) -> Snapshot:
+        return self.primary.snapshot(self.fields)
 
-    def save(self, data: dict):
-        with self.OUTPUT_FILE.open("w", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["id", "name", "active", "ip"])  # Write header
-            for result in data["results"]:
-                meta = result["resource_meta"]
-                if "ip" in meta:
-                    ip = meta["ip"]
-                else:
-                    ip = "Not available"
-                writer.writerow([result["id"], result["name"], result["active"], ip])
+    def commit(self, snapshot: Snapshot) -> None:
+        self.primary.commit(snapshot)
 
-        logger.info(f"Data successfully saved to {self.OUTPUT_FILE}")
 
+def first_run(stdscr: "curses.window"):
+    import curses
 
-def first_run(stdscr: curses.window):
     scriptdir = Path.home() / config["files"]["scriptdir"]
     if not scriptdir.exists():
-        logger.info(f"Creating directory {scriptdir}")
+        logger.info("Creating directory %s", scriptdir)
         scriptdir.mkdir(parents=True)
 
     user_config_file = scriptdir / "config.toml"
     if not user_config_file.exists():
         default_config = Path(__file__).parent / "config.toml"
         shutil.copy(default_config, user_config_file)
-        logger.info(f"Created default configuration file at {user_config_file}")
+        logger.info("Created default configuration file at %s", user_config_file)
 
     auth_token_file = scriptdir / config["files"]["api-token"]
     auth_created = False
@@ -157,7 +547,7 @@ def first_run(stdscr: curses.window):
         return user_input
 
     if not scriptdir.exists():
-        logger.info(f"Creating directory {scriptdir}")
+        logger.info("Creating directory %s", scriptdir)
         scriptdir.mkdir()
 
     username = scriptdir / config["files"]["username"]
@@ -167,13 +557,13 @@ def first_run(stdscr: curses.window):
 
     # Check and create API token
     if not auth_token_file.exists():
-        logger.warning(f"API token not found at {auth_token_file}")
+        logger.warning("API token not found at %s", auth_token_file)
         AUTH_TOKEN = get_user_input("Enter API token: ")
         auth_token_file.write_text(AUTH_TOKEN)
         auth_created = True
 
     if not csrf_token_file.exists():
-        logger.warning(f"CSRF token not found at {csrf_token_file}")
+        logger.warning("CSRF token not found at %s", csrf_token_file)
         CSRF_TOKEN = get_user_input("Enter CSRF token: ")
         csrf_token_file.write_text(CSRF_TOKEN)
         csrf_created = True
@@ -184,7 +574,8 @@ def first_run(stdscr: curses.window):
         stdscr.addstr(0, 0, "Testing tokens...")
         stdscr.refresh()
 
-        workspace = Workspace()
+        # Use a fresh client, the shared one may hold the tokens of a failed attempt
+        workspace = Workspace(client=Client())
         vms = workspace.get_workspaces(save=False)
 
         if vms is None:
@@ -220,11 +611,12 @@ def first_run(stdscr: curses.window):
 
 
 def main():
+    setup_logger()
     workspace = Workspace()
     action = Action()
     data = workspace.get_workspaces(save=True)
-    logger.info(data)
-    action("pause", data, [])
+    logger.info("%s", data)
+    action("pause", data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from surf_controller.utils import config, logger
+
+
+class ListingCache:
+    """On-disk copy of the last complete workspace listing.
+
+    Every page is stored under its URL together with the ETag and
+    Last-Modified headers it came with, so a later listing can revalidate each
+    page with a conditional request instead of downloading it again.
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: Optional[float] = None):
+        scriptdir = Path.home() / config["files"]["scriptdir"]
+        self.path = path or scriptdir / config["cache"]["file"]
+        self.ttl = ttl if ttl is not None else config["cache"]["ttl"]
+        self.fetched_at = 0.0
+        self.pages: dict = {}
+        self.pending: dict = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            entry = json.loads(self.path.read_text())
+            self.fetched_at = entry["fetched_at"]
+            self.pages = entry["pages"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable cache %s: %s", self.path, e)
+
+    def save(self) -> None:
+        """Replace the cached listing with the pages collected since the last save."""
+        with self.lock:
+            self.pages = self.pending
+            self.pending = {}
+            self.fetched_at = time.time()
+            entry = {"fetched_at": self.fetched_at, "pages": self.pages}
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.")
+        with os.fdopen(fd, "w") as file:
+            file.write(json.dumps(entry))
+        os.replace(tmp, self.path)
+
+    def fresh(self) -> bool:
+        return bool(self.pages) and time.time() - self.fetched_at < self.ttl
+
+    def results(self) -> list:
+        results = []
+        for page in self.pages.values():
+            results.extend(page["data"]["results"])
+        return results
+
+    def validators(self, url: str) -> dict:
+        page = self.pages.get(url)
+        if page is None:
+            return {}
+        headers = {}
+        if page.get("etag"):
+            headers["If-None-Match"] = page["etag"]
+        if page.get("last_modified"):
+            headers["If-Modified-Since"] = page["last_modified"]
+        return headers
+
+    def page(self, url: str) -> Optional[dict]:
+        page = self.pages.get(url)
+        return page["data"] if page else None
+
+    def put(self, url: str, data: dict, headers) -> None:
+        # a 304 response does not have to repeat the validators
+        previous = self.pages.get(url, {})
+        with self.lock:
+            self.pending[url] = {
+                "etag": headers.get("ETag") or previous.get("etag"),
+                "last_modified": headers.get("Last-Modified")
+                or previous.get("last_modified"),
+                "data": data,
+            }
@@ -0,0 +1,356 @@
+import argparse
+import json
+import os
+import sys
+import re
+import signal
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime
+from typing import Optional
+
+from surf_controller.api import CANCELLED, Action, Fleet
+from surf_controller.fanout import FanOut, summarize
+from surf_controller.history import get_history
+from surf_controller.journal import Journal
+from surf_controller.metrics import metrics, profiler
+from surf_controller.registry import matching
+from surf_controller.snapshot import FORMATS, Output
+from surf_controller.utils import config, setup_logger
+
+RESULT_FIELDS = ["id", "name", "action", "ok", "status_code", "latency", "error"]
+PLAN_FIELDS = ["id", "name", "account", "action"]
+UPTIME_FIELDS = ["id", "name", "hours", "last_active", "idle_since"]
+JOB_FIELDS = ["id", "action", "selector", "created", "finished", "calls", "done", "failed", "pending"]
+
+
+def select(args, fleet: Fleet):
+    vms = fleet.iter_workspaces(args.user)
+    return matching(vms, args.match, args.id, account=args.account)
+
+
+def list_workspaces(args, fleet: Fleet) -> int:
+    out = Output(args.format, fleet.fields)
+    for vm in select(args, fleet):
+        out.write(vm.as_dict())
+    out.close()
+    return 0 if fleet.complete else 1
+
+
+def plan(args, fleet: Fleet, journal: Journal) -> tuple[Optional[int], list]:
+    """The job to continue, if any, and the workspaces to call.
+
+    Workspaces already in the wanted state are left out. For workspaces a
+    job paused or resumed less than `[wait] timeout` seconds ago, which the
+    listing may not show yet, the outcome of that job counts instead of the
+    listing. Running the same command again therefore only calls the ones
+    that did not get there. With --resume, the calls of the job that have not
+    succeeded are taken instead of the selectors.
+    """
+    active = args.command == "resume"
+    if args.resume is None:
+        recent = journal.recent(time.time() - config["wait"]["timeout"])
+        vms = list(select(args, fleet))
+        return None, [
+            vm
+            for vm in vms
+            if (recent[vm.id] != args.command if vm.id in recent else vm.active != active)
+        ]
+
+    job = journal.job(args.resume or None, args.command)
+    if job is None or job["action"] != args.command:
+        raise ValueError(f"No unfinished {args.command} job to resume")
+    listed = {vm.id: vm for vm in fleet.iter_workspaces()}
+    targets = []
+    for vm_id in journal.pending(job["id"]):
+        vm = listed.get(vm_id)
+        if vm is not None and vm.active != active:
+            targets.append(vm)
+        elif not args.dry_run and fleet.complete:
+            if vm is None:
+                journal.settle(job["id"], vm_id, "failed", "no longer listed")
+            else:
+                journal.settle(job["id"], vm_id, "done", None)
+    return job["id"], targets
+
+
+def run_action(args, fleet: Fleet) -> int:
+    journal = Journal()
+    try:
+        try:
+            job, vms = plan(args, fleet, journal)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        if not fleet.complete:
+            print("Failed to list workspaces, nothing was sent", file=sys.stderr)
+            return 1
+
+        if args.dry_run:
+            out = Output(args.format, PLAN_FIELDS)
+            for vm in vms:
+                out.write(
+                    {"id": vm.id, "name": vm.name, "account": vm.account, "action": args.command}
+                )
+            out.close()
+            print(f"{out.count} {args.command} calls would be sent", file=sys.stderr)
+            return 0
+        if job is None:
+            selector = {
+                "match": args.match,
+                "id": args.id,
+                "user": args.user,
+                "account": args.account,
+            }
+            job = journal.create(args.command, vms, selector)
+
+        action = Action(
+            concurrency=args.concurrency, client=fleet.primary.client, clients=fleet.clients
+        )
+        out = Output(args.format, RESULT_FIELDS)
+        failed = 0
+        interrupted = threading.Event()
+
+        def interrupt(signum, frame):
+            # Only the calls in flight are finished and journaled; a second
+            # Ctrl-C stops right away
+            interrupted.set()
+            action.stop()
+            signal.signal(signal.SIGINT, previous)
+
+        previous = signal.signal(signal.SIGINT, interrupt)
+        try:
+            for result in action.run(args.command, vms):
+                if result.error == CANCELLED:
+                    # Never sent, it stays pending for --resume
+                    continue
+                # Stored before it is printed, a run that dies still has the outcome
+                journal.record(job, result)
+                failed += not result.ok
+                out.write({**asdict(result), "ok": result.ok})
+        finally:
+            signal.signal(signal.SIGINT, previous)
+        out.close()
+        if interrupted.is_set():
+            print(
+                f"Interrupted after {out.count} {args.command} calls, "
+                f"send the rest with --resume {job}",
+                file=sys.stderr,
+            )
+            return 130
+        if not journal.finish(job):
+            print(
+                f"{failed} of {out.count} {args.command} calls failed, "
+                f"retry them with --resume {job}",
+                file=sys.stderr,
+            )
+            return 1
+        return 0
+    finally:
+        journal.close()
+
+
+def list_jobs(args, fleet: Fleet) -> int:
+    journal = Journal()
+    try:
+        out = Output(args.format, JOB_FIELDS)
+        for job in journal.jobs(args.limit):
+            if args.format == "csv":
+                # A cell of JSON rather than the repr of a dict
+                job["selector"] = json.dumps(job["selector"], sort_keys=True)
+            out.write(job)
+        out.close()
+    finally:
+        journal.close()
+    return 0
+
+
+def exec_command(args, fleet: Fleet) -> int:
+    vms = list(select(args, fleet))
+    if not fleet.complete:
+        print("Failed to list workspaces, nothing was run", file=sys.stderr)
+        return 1
+    remote = args.remote[1:] if args.remote[:1] == ["--"] else args.remote
+    if not remote:
+        print("No command given", file=sys.stderr)
+        return 2
+
+    lock = threading.Lock()
+
+    def on_line(vm, line: str) -> None:
+        with lock:
+            print(f"{vm.name} | {line}", flush=True)
+
+    fanout = FanOut(" ".join(remote), concurrency=args.concurrency, on_line=on_line)
+    results = fanout(vms)
+    print(summarize(results), file=sys.stderr)
+    return 0 if all(result.ok for result in results) else 1
+
+
+def uptime(args, fleet: Fleet) -> int:
+    """Hours every workspace ran since --since, from the history store."""
+    history = get_history()
+    if history is None:
+        print("No history is kept, set [history] file in the config", file=sys.stderr)
+        return 1
+    now = datetime.now()
+    start = args.since or now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = args.until or now
+    hours = history.uptime(start.timestamp(), end.timestamp())
+    last_active = history.last_active()
+    idle_since = history.idle_since()
+    names = history.names()
+    pattern = re.compile(args.match) if args.match else None
+
+    def timestamp(value: Optional[float]) -> Optional[str]:
+        return value and datetime.fromtimestamp(value).isoformat(timespec="seconds")
+
+    out = Output(args.format, UPTIME_FIELDS)
+    for vm_id, name in sorted(names.items(), key=lambda item: -hours.get(item[0], 0)):
+        if pattern and not pattern.search(name):
+            continue
+        out.write(
+            {
+                "id": vm_id,
+                "name": name,
+                "hours": round(hours.get(vm_id, 0) / 3600, 2),
+                "last_active": timestamp(last_active.get(vm_id)),
+                "idle_since": timestamp(idle_since.get(vm_id)),
+            }
+        )
+    out.close()
+    return 0
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="surfcontroller",
+        description="Control SURF workspaces. Without a command the interactive controller starts.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"save a cProfile dump of the session to ~/.surf_controller/{config['metrics']['profile']}",
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    selectors = argparse.ArgumentParser(add_help=False)
+    selectors.add_argument("--match", help="only workspaces whose name matches this regex")
+    selectors.add_argument("--id", action="append", help="only this workspace id (repeatable)")
+    selectors.add_argument("--user", help="only workspaces whose name contains this username")
+    selectors.add_argument("--account", help="only workspaces of this [accounts] entry")
+    common = argparse.ArgumentParser(add_help=False, parents=[selectors])
+    common.add_argument("--format", choices=FORMATS, default="ndjson")
+
+    listing = commands.add_parser("list", parents=[common], help="list workspaces")
+    listing.set_defaults(func=list_workspaces)
+    for do in ("pause", "resume"):
+        command = commands.add_parser(do, parents=[common], help=f"{do} workspaces")
+        command.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help=f"calls in flight at once (default {config['action']['concurrency']})",
+        )
+        command.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="print the calls that would be sent and send nothing",
+        )
+        command.add_argument(
+            "--resume",
+            nargs="?",
+            type=int,
+            const=0,
+            metavar="JOB",
+            help=f"retry the calls of an earlier {do} job that did not succeed "
+            "(default the latest unfinished one) instead of selecting workspaces",
+        )
+        command.set_defaults(func=run_action)
+    command = commands.add_parser(
+        "uptime",
+        help="hours every workspace was running, when it was last active and since "
+        "when it is idle, from the history of listings",
+    )
+    command.add_argument("--match", help="only workspaces whose name matches this regex")
+    command.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        help="start of the period, e.g. 2024-05-01 (default the start of this month)",
+    )
+    command.add_argument(
+        "--until", type=datetime.fromisoformat, help="end of the period (default now)"
+    )
+    command.add_argument("--format", choices=FORMATS, default="ndjson")
+    command.set_defaults(func=uptime)
+    command = commands.add_parser("jobs", help="show the latest pause/resume jobs")
+    command.add_argument("--format", choices=FORMATS, default="ndjson")
+    command.add_argument("--limit", type=int, default=20, help="number of jobs (default 20)")
+    command.set_defaults(func=list_jobs)
+    command = commands.add_parser(
+        "exec",
+        parents=[selectors],
+        help="run a command over ssh on the running workspaces, in parallel",
+    )
+    command.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help=f"hosts contacted at once (default {config['ssh']['concurrency']})",
+    )
+    command.add_argument("remote", nargs=argparse.REMAINDER, help="-- command to run")
+    command.set_defaults(func=exec_command)
+    commands.add_parser(
+        "daemon",
+        help="keep the fleet in memory, run the [[schedule]]s from the config "
+        "and serve the TUI on a local socket",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list] = None) -> int:
+    args = parse_args(argv)
+    if args.profile:
+        profiler.start()
+    try:
+        return run(args)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # The reader went away, e.g. `surfcontroller list | head`; point
+        # stdout at devnull so flushing it at exit does not fail again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    finally:
+        if args.profile:
+            path = config.scriptdir / config["metrics"]["profile"]
+            profiler.stop(path)
+            print(f"Profile written to {path}", file=sys.stderr)
+
+
+def run(args: argparse.Namespace) -> int:
+    if args.command is None:
+        from surf_controller.gui import main as gui_main
+
+        gui_main()
+        return 0
+    if args.command == "daemon":
+        from surf_controller.daemon import main as daemon_main
+
+        setup_logger(use_curses=False)
+        daemon_main()
+        return 0
+
+    setup_logger()
+    concurrency = getattr(args, "concurrency", None) or config["action"]["concurrency"]
+    fleet = Fleet(pool_size=max(concurrency, 10))
+    try:
+        return args.func(args, fleet)
+    finally:
+        metrics.write(config.scriptdir / config["metrics"]["file"])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import threading
+import time
+from typing import Optional
+
+from surf_controller.governor import get_governor, retry_after, throttled
+from surf_controller.metrics import metrics
+from surf_controller.utils import config, logger
+
+
+class RequestError(Exception):
+    """The gateway could not be reached or did not answer in time."""
+
+
+class Client:
+    """HTTP client shared by Workspace and Action.
+
+    Owns one pooled `requests.Session`, so connections to the gateway are kept
+    alive between calls, together with the auth headers and a retry policy for
+    5xx responses and dropped connections. `requests` is only imported when the
+    first request is made. Requests are paced by the `Governor`, and a request
+    the gateway throttles is queued again behind it.
+    """
+
+    def __init__(
+        self,
+        auth_token: Optional[str] = None,
+        csrf_token: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        account: str = "",
+    ):
+        # Tokens that are not given are read from the token files of the
+        # account on every request, which is cheap because config caches them
+        # by mtime
+        self.auth_token = auth_token
+        self.csrf_token = csrf_token
+        self.pool_size = pool_size
+        self.account = account
+        self._session = None
+        self.lock = threading.Lock()
+        for kind, token in (("API", self.AUTH_TOKEN), ("CSRF", self.CSRF_TOKEN)):
+            if token is None:
+                where = f"account {account}" if account else config.scriptdir
+                logger.warning("%s token not found for %s", kind, where)
+
+    @property
+    def AUTH_TOKEN(self) -> Optional[str]:
+        return self.auth_token or config.read("api-token", self.account)
+
+    @property
+    def CSRF_TOKEN(self) -> Optional[str]:
+        return self.csrf_token or config.read("csrf-token", self.account)
+
+    @property
+    def session(self):
+        with self.lock:
+            if self._session is None:
+                self._session = self.build_session()
+            return self._session
+
+    def build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # 429s and 503s have to reach the governor, which paces every process
+        governed = get_governor() is not None
+        retry = Retry(
+            total=config["client"]["retries"],
+            backoff_factor=config["client"]["backoff"],
+            status_forcelist=(500, 502, 504) if governed else (500, 502, 503, 504),
+            # pause and resume are safe to repeat, so POST is retried as well
+            allowed_methods=None,
+            raise_on_status=False,
+            respect_retry_after_header=not governed,
+        )
+        pool_size = self.pool_size or max(config["action"]["concurrency"], 10)
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"accept": "application/json;Compute"})
+        return session
+
+    def request(self, method: str, url: str, headers: Optional[dict] = None, **kwargs):
+        governor = get_governor()
+        if governor is None:
+            return self.send(method, url, headers, **kwargs)
+        for attempt in range(config["governor"]["retries"] + 1):
+            governor.acquire()
+            try:
+                response = self.send(method, url, headers, **kwargs)
+            except BaseException:
+                governor.release()
+                raise
+            if not throttled(response):
+                governor.release()
+                return response
+            delay = retry_after(response)
+            governor.release(throttled=True, delay=delay)
+            metrics.inc("surf_throttled_total", endpoint=self.endpoint(method, url))
+            logger.info(
+                "%s %s throttled (%s), queued again to run in %.1fs",
+                method, url, response.status_code, delay,
+            )
+        return response
+
+    def send(self, method: str, url: str, headers: Optional[dict] = None, **kwargs):
+        import requests
+
+        headers = dict(headers or {})
+        if self.AUTH_TOKEN:
+            headers["authorization"] = self.AUTH_TOKEN
+        kwargs.setdefault("timeout", config["client"]["timeout"])
+        endpoint = self.endpoint(method, url)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        except requests.RequestException as e:
+            metrics.inc("surf_responses_total", endpoint=endpoint, status="error")
+            raise RequestError(str(e)) from e
+        finally:
+            metrics.observe(
+                "surf_request_seconds", time.perf_counter() - start, endpoint=endpoint
+            )
+        metrics.inc(
+            "surf_responses_total", endpoint=endpoint, status=str(response.status_code)
+        )
+        return response
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        """Metrics label for a URL, without the workspace id in it."""
+        path, _, query = url.partition("?")
+        if "/actions/" in path:
+            return f"{method} actions/{path.rstrip('/').rsplit('/', 1)[-1]}"
+        if query or path.rstrip("/").endswith("workspaces"):
+            return f"{method} list"
+        return f"{method} workspace"
+
+    def get(self, url: str, headers: Optional[dict] = None, **kwargs):
+        return self.request("GET", url, headers=headers, **kwargs)
+
+    def post(self, url: str, headers: Optional[dict] = None, **kwargs):
+        headers = dict(headers or {})
+        if self.CSRF_TOKEN:
+            headers["X-CSRFTOKEN"] = self.CSRF_TOKEN
+        return self.request("POST", url, headers=headers, **kwargs)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Client:
+    """Return the process-wide client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
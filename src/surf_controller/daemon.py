@@ -0,0 +1,301 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from surf_controller.api import Action, ActionResult, Fleet
+from surf_controller.registry import Registry, WorkspaceRecord, matching
+from surf_controller.utils import config, logger
+from surf_controller.waiter import Waiter
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+@dataclass
+class Schedule:
+    """One `[[schedule]]` table from the config: the state a set of workspaces
+    should be in from a time of day onwards."""
+
+    action: str
+    at: str
+    match: Optional[str] = None
+    user: Optional[str] = None
+    days: list[str] = field(default_factory=lambda: list(DAYS))
+    name: str = ""
+
+    def __post_init__(self):
+        if self.action not in ("pause", "resume"):
+            raise ValueError(f"schedule action must be pause or resume, not {self.action!r}")
+        hour, minute = self.at.split(":")
+        self.hour, self.minute = int(hour), int(minute)
+        self.weekdays = {DAYS.index(day[:3].lower()) for day in self.days}
+        if not self.name:
+            self.name = f"{self.action} {self.match or 'all'} at {self.at}"
+
+    @property
+    def active(self) -> bool:
+        """The `active` flag the matching workspaces should end up with."""
+        return self.action == "resume"
+
+    def next_run(self, after: datetime) -> datetime:
+        for offset in range(8):
+            day = after + timedelta(days=offset)
+            run = day.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+            if run > after and run.weekday() in self.weekdays:
+                return run
+        raise ValueError(f"schedule {self.name!r} has no days to run on")
+
+
+def load_schedules() -> list[Schedule]:
+    return [Schedule(**entry) for entry in config.get("schedule", [])]
+
+
+def socket_path() -> Path:
+    return config.scriptdir / config["daemon"]["socket"]
+
+
+class Daemon:
+    """Keep the fleet in memory and apply the configured schedules.
+
+    The daemon holds one client per account, so connections to the gateway
+    stay warm, and relists the fleet every `[daemon] refresh` seconds with
+    conditional requests. When a schedule is due only the matching workspaces
+    that are not already in the wanted state are called. The fleet and the
+    actions are also served on a unix socket, which the TUI attaches to (see
+    `DaemonClient`).
+    """
+
+    def __init__(self, path: Optional[Path] = None, refresh: Optional[float] = None):
+        self.path = path or socket_path()
+        self.refresh_interval = refresh or config["daemon"]["refresh"]
+        concurrency = config["action"]["concurrency"]
+        self.workspace = Fleet(cache=True, pool_size=max(concurrency, 10))
+        self.action = Action(client=self.workspace.primary.client, clients=self.workspace.clients)
+        self.waiter = Waiter(self.workspace)
+        self.vms = Registry()
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.schedules = [[schedule, None] for schedule in load_schedules()]
+
+    def refresh(self) -> bool:
+        with self.refresh_lock:
+            vms = self.workspace.get_workspaces(save=True)
+            if not self.workspace.complete:
+                logger.warning("Daemon: failed to refresh the workspace list")
+                return False
+            with self.lock:
+                self.vms.replace(vms)
+                self.fetched_at = time.time()
+        return True
+
+    def listing(self) -> list[WorkspaceRecord]:
+        with self.lock:
+            return list(self.vms)
+
+    def update(self, record: Optional[WorkspaceRecord]) -> None:
+        if record is not None:
+            with self.lock:
+                self.vms.update(record)
+
+    def run_action(self, do: str, ids: Optional[list] = None) -> list[ActionResult]:
+        """Send `do` to the workspaces in `ids` and follow them in the background."""
+        results = self.action(do, self.listing(), ids)
+        done = {result.id for result in results if result.ok}
+        targets = [vm for vm in self.listing() if vm.id in done]
+        if targets:
+            threading.Thread(
+                target=self.waiter,
+                args=(targets, do == "resume"),
+                kwargs={"on_settled": lambda t: self.update(t.workspace)},
+                daemon=True,
+            ).start()
+        return results
+
+    def enforce(self, schedule: Schedule) -> list[ActionResult]:
+        if not self.refresh():
+            logger.warning("Daemon: skipping %s, the fleet is unknown", schedule.name)
+            return []
+        targets = [
+            vm
+            for vm in matching(self.listing(), schedule.match, user=schedule.user)
+            if vm.active != schedule.active
+        ]
+        logger.info("Daemon: %s: %d workspaces to %s", schedule.name, len(targets), schedule.action)
+        if not targets:
+            return []
+        results = self.run_action(schedule.action, [vm.id for vm in targets])
+        failed = sum(not result.ok for result in results)
+        if failed:
+            logger.warning("Daemon: %s: %d of %d calls failed", schedule.name, failed, len(results))
+        return results
+
+    def handle(self, request: dict) -> dict:
+        cmd = request.get("cmd")
+        if cmd == "status":
+            return {
+                "fetched_at": self.fetched_at,
+                "workspaces": len(self.vms),
+                "schedules": [
+                    {"name": schedule.name, "next": next_run and next_run.isoformat()}
+                    for schedule, next_run in self.schedules
+                ],
+            }
+        if cmd in ("list", "refresh"):
+            if cmd == "refresh" or not self.fetched_at:
+                self.refresh()
+            return {
+                "fetched_at": self.fetched_at,
+                "workspaces": [vm.as_dict() for vm in self.listing()],
+            }
+        if cmd == "get":
+            # Kept up to date by the waiter of the action that changed it
+            with self.lock:
+                record = self.vms.get(request["id"])
+            return {"workspace": record and record.as_dict()}
+        if cmd in ("pause", "resume"):
+            # An empty selection would call the whole fleet, of every account
+            if not request.get("ids"):
+                raise ValueError(f"{cmd} needs the ids of the workspaces to call")
+            results = self.run_action(cmd, request["ids"])
+            return {"results": [asdict(result) for result in results]}
+        raise ValueError(f"unknown command {cmd!r}")
+
+    def serve(self) -> socketserver.BaseServer:
+        if self.path.exists():
+            if DaemonClient.connect(self.path) is not None:
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            self.path.unlink()
+        server = socketserver.ThreadingUnixStreamServer(str(self.path), Handler)
+        server.daemon_threads = True
+        server.surf_daemon = self
+        os.chmod(self.path, 0o600)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def stop(self, *args) -> None:
+        self.stopping.set()
+        self.action.stop()
+        self.waiter.stop()
+
+    def run(self) -> None:
+        server = self.serve()
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info("Daemon listening on %s, %d schedules", self.path, len(self.schedules))
+        now = datetime.now()
+        for entry in self.schedules:
+            entry[1] = entry[0].next_run(now)
+        next_refresh = 0.0
+        try:
+            while not self.stopping.is_set():
+                if time.monotonic() >= next_refresh:
+                    # One failed step must not stop the daemon
+                    try:
+                        self.refresh()
+                    except Exception:
+                        logger.exception("Daemon: refresh failed")
+                    next_refresh = time.monotonic() + self.refresh_interval
+                now = datetime.now()
+                for entry in self.schedules:
+                    schedule, next_run = entry
+                    if next_run <= now:
+                        try:
+                            self.enforce(schedule)
+                        except Exception:
+                            logger.exception("Daemon: %s failed", schedule.name)
+                        entry[1] = schedule.next_run(now)
+                # Sleep until the next refresh or schedule, whichever is first
+                wait = next_refresh - time.monotonic()
+                for _, next_run in self.schedules:
+                    wait = min(wait, (next_run - datetime.now()).total_seconds())
+                self.stopping.wait(max(wait, 0.1))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.path.unlink(missing_ok=True)
+            for client in self.workspace.clients.values():
+                client.close()
+            logger.info("Daemon stopped")
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """One JSON request per line, answered by one JSON line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.surf_daemon.handle(json.loads(line))
+            except Exception as e:
+                logger.error("Daemon: request failed: %s", e)
+                response = {"error": str(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class DaemonClient:
+    """Talk to a running daemon; has the parts of `Workspace` the TUI uses,
+    so the TUI can take its listing and send its actions through the daemon
+    instead of calling the API itself."""
+
+    def __init__(self, path: Path, timeout: Optional[float] = None):
+        self.path = path
+        self.timeout = timeout or config["client"]["timeout"]
+
+    @classmethod
+    def connect(cls, path: Optional[Path] = None) -> Optional["DaemonClient"]:
+        """A client for the daemon on `path`, or None if none is running."""
+        path = path or socket_path()
+        if not path.exists():
+            return None
+        daemon = cls(path, timeout=1)
+        try:
+            daemon.request("status")
+        except (OSError, ValueError):
+            return None
+        daemon.timeout = config["client"]["timeout"]
+        return daemon
+
+    def request(self, cmd: str, wait: bool = False, **kwargs) -> dict:
+        """Send one command; with `wait` there is no timeout, for actions,
+        which take as long as the calls they make."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(None if wait else self.timeout)
+            sock.connect(str(self.path))
+            sock.sendall(json.dumps({"cmd": cmd, **kwargs}).encode() + b"\n")
+            response = json.loads(sock.makefile("rb").readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def get_workspaces(
+        self, username: Optional[str] = None, refresh: bool = False
+    ) -> list[WorkspaceRecord]:
+        response = self.request("refresh" if refresh else "list")
+        records = [WorkspaceRecord(**vm) for vm in response["workspaces"]]
+        return list(matching(records, user=username))
+
+    def get_workspace(self, workspace_id: str) -> Optional[WorkspaceRecord]:
+        """The daemon's copy of a workspace, so `Waiter` can poll the daemon."""
+        try:
+            vm = self.request("get", id=workspace_id)["workspace"]
+        except (OSError, ValueError) as e:
+            logger.warning("Daemon: failed to get %s: %s", workspace_id, e)
+            return None
+        return vm and WorkspaceRecord(**vm)
+
+    def run_action(self, do: str, ids: set) -> list[ActionResult]:
+        response = self.request(do, wait=True, ids=sorted(ids))
+        return [ActionResult(**result) for result in response["results"]]
+
+
+def main() -> None:
+    Daemon().run()
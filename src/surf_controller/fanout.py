@@ -0,0 +1,153 @@
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+from surf_controller.utils import config, logger
+
+
+@dataclass
+class HostResult:
+    id: str
+    name: str
+    ip: str
+    exit_code: Optional[int]
+    elapsed: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.exit_code == 0
+
+
+def has_ip(vm) -> bool:
+    return bool(vm.ip) and vm.ip != "Not available"
+
+
+def ssh_command(ip: str, *args: str, batch: bool = False) -> list[str]:
+    """The ssh command line for `ip`, sharing one connection per host.
+
+    The first session to a host opens a master connection on a control socket
+    in the script directory and later sessions, from the TUI or the fan-out,
+    reuse it for `[ssh] control-persist` seconds.
+    """
+    ssh = config["ssh"]
+    command = [
+        ssh["binary"],
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={config.scriptdir / 'ssh-%C'}",
+        "-o", f"ControlPersist={ssh['control-persist']}",
+    ]
+    if batch:
+        # nobody is there to answer a password or host key prompt
+        command += ["-o", "BatchMode=yes"]
+    return command + list(ssh["options"]) + [ip, *args]
+
+
+def summarize(results: list[HostResult]) -> str:
+    failed = [result for result in results if not result.ok]
+    message = f"{len(results) - len(failed)}/{len(results)} hosts exited 0"
+    if failed:
+        message += ", failed: " + ", ".join(
+            f"{result.name} ({result.error or f'exit {result.exit_code}'})"
+            for result in failed
+        )
+    return message
+
+
+class FanOut:
+    """Run one command over ssh on many workspaces at once.
+
+    At most `concurrency` hosts are contacted at the same time. Every line a
+    host prints is handed to `on_line(vm, line)` as it arrives, and a
+    `HostResult` with the exit code is yielded per host when it finishes.
+    """
+
+    def __init__(
+        self,
+        command: str,
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        on_line: Optional[Callable] = None,
+    ):
+        self.command = command
+        self.concurrency = concurrency or config["ssh"]["concurrency"]
+        self.timeout = timeout or config["ssh"]["timeout"]
+        self.on_line = on_line
+        self.processes: set = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def __call__(self, vms: list) -> list[HostResult]:
+        return list(self.run(vms))
+
+    def run(self, vms: list) -> Iterator[HostResult]:
+        hosts = []
+        for vm in vms:
+            if not vm.active:
+                yield HostResult(vm.id, vm.name, vm.ip, None, 0.0, "paused")
+            elif not has_ip(vm):
+                yield HostResult(vm.id, vm.name, vm.ip, None, 0.0, "no ip address")
+            else:
+                hosts.append(vm)
+        if not hosts:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(hosts))) as pool:
+            futures = [pool.submit(self.run_host, vm) for vm in hosts]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def stop(self) -> None:
+        """Kill the commands that are running and skip the hosts not started yet."""
+        self.stopping.set()
+        with self.lock:
+            for process in self.processes:
+                process.kill()
+
+    def run_host(self, vm) -> HostResult:
+        if self.stopping.is_set():
+            return HostResult(vm.id, vm.name, vm.ip, None, 0.0, "cancelled")
+        start = time.perf_counter()
+        try:
+            process = subprocess.Popen(
+                ssh_command(vm.ip, self.command, batch=True),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+            )
+        except OSError as e:
+            logger.warning("%s | %s | ssh failed to start: %s", vm.name, vm.ip, e)
+            return HostResult(vm.id, vm.name, vm.ip, None, 0.0, str(e))
+        with self.lock:
+            self.processes.add(process)
+        # The output is read on this thread, so the timeout is enforced by a timer
+        timer = threading.Timer(self.timeout, process.kill)
+        timer.start()
+        try:
+            for line in process.stdout:
+                if self.on_line:
+                    self.on_line(vm, line.rstrip("\n"))
+            exit_code = process.wait()
+        finally:
+            timer.cancel()
+            with self.lock:
+                self.processes.discard(process)
+        elapsed = time.perf_counter() - start
+        error = None
+        if exit_code < 0:
+            error = "cancelled" if self.stopping.is_set() else "timeout"
+        logger.info(
+            "%s | %s | `%s` exited %s after %.1fs",
+            vm.name, vm.ip, self.command, exit_code, elapsed,
+            extra={
+                "workspace_id": vm.id,
+                "workspace": vm.name,
+                "exit_code": exit_code,
+                "latency": elapsed,
+            },
+        )
+        return HostResult(vm.id, vm.name, vm.ip, exit_code, elapsed, error)
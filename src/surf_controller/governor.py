@@ -0,0 +1,181 @@
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the budget is then per process
+    fcntl = None
+
+from surf_controller.utils import config, logger
+
+# tokens, updated, blocked_until, rate, decreased_at
+STATE = struct.Struct("5d")
+
+
+def throttled(response) -> bool:
+    """Whether the gateway turned the request down because of its rate limit
+    or because it is overloaded; either way it wants fewer requests."""
+    return response.status_code in (429, 503)
+
+
+def retry_after(response, default: float = 1.0) -> float:
+    """Seconds the `Retry-After` header of `response` asks to wait."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class Governor:
+    """Keep the requests of all surfcontroller processes under the gateway's limit.
+
+    Requests take a token from a bucket that refills at `rate` per second, up
+    to `burst`. The bucket lives in a small file under an fcntl lock, so the
+    TUI, the daemon and cron jobs on one machine draw from the same budget.
+    The rate adapts like TCP congestion control: every successful request
+    raises it by 1/rate, and a throttled one halves it, at most once per
+    second, and blocks every process for the `Retry-After` the gateway asked
+    for. Within a process, the requests in flight are limited by a window
+    that adapts the same way, between 1 and `max_concurrency`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        settings = config["governor"]
+        self.path = path or config.scriptdir / settings["file"]
+        self.initial_rate = rate or settings["rate"]
+        self.min_rate = min(settings["min-rate"], self.initial_rate)
+        self.max_rate = max(settings["max-rate"], self.initial_rate)
+        self.burst = burst or settings["burst"]
+        self.max_concurrency = max_concurrency or max(config["action"]["concurrency"], 1)
+        self.window = float(self.max_concurrency)
+        self.window_decreased_at = 0.0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        # flock does not keep apart threads sharing the file descriptor
+        self.lock = threading.Lock()
+        # Without fcntl (and os.pread) the state stays in this process
+        self.fd = None
+        self.data = b""
+        if fcntl:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    @contextmanager
+    def locked_state(self) -> Iterator[list]:
+        """The shared state as a list to change in place, under the file lock."""
+        with self.lock:
+            if self.fd is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                data = self.data if self.fd is None else os.pread(self.fd, STATE.size, 0)
+                now = time.time()
+                if len(data) == STATE.size:
+                    state = list(STATE.unpack(data))
+                else:
+                    state = [self.burst, now, 0.0, self.initial_rate, 0.0]
+                if now - state[1] > 600:
+                    # What was learned about the gateway's limit is stale
+                    state[3] = self.initial_rate
+                yield state
+                self.data = STATE.pack(*state)
+                if self.fd is not None:
+                    os.pwrite(self.fd, self.data, 0)
+            finally:
+                if self.fd is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def take(self) -> float:
+        """Take a token if there is one; otherwise the seconds to wait for one."""
+        with self.locked_state() as state:
+            tokens, updated, blocked_until, rate, _ = state
+            now = time.time()
+            state[0] = tokens = min(self.burst, tokens + max(now - updated, 0) * rate)
+            state[1] = now
+            if now < blocked_until:
+                return blocked_until - now
+            if tokens >= 1:
+                state[0] = tokens - 1
+                return 0.0
+            return (1 - tokens) / rate
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.in_flight >= int(self.window):
+                self.condition.wait()
+            self.in_flight += 1
+        try:
+            while True:
+                wait = self.take()
+                if not wait:
+                    return
+                time.sleep(wait)
+        except BaseException:
+            self.release_slot()
+            raise
+
+    def release_slot(self) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def release(self, throttled: bool = False, delay: float = 0.0) -> None:
+        """Finish a request; `throttled` with the `delay` the gateway asked for."""
+        with self.condition:
+            if throttled:
+                if time.monotonic() - self.window_decreased_at >= 1:
+                    self.window = max(self.window / 2, 1.0)
+                    self.window_decreased_at = time.monotonic()
+            else:
+                self.window = min(self.window + 1 / self.window, self.max_concurrency)
+        self.release_slot()
+        with self.locked_state() as state:
+            now = time.time()
+            if not throttled:
+                state[3] = min(state[3] + 1 / state[3], self.max_rate)
+                return
+            state[2] = max(state[2], now + delay)
+            if now - state[4] >= 1:
+                # One slowdown per burst of throttled responses
+                state[3] = max(state[3] / 2, self.min_rate)
+                state[4] = now
+                logger.info(
+                    "Throttled by the gateway, slowing down to %.1f requests/s", state[3]
+                )
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+_governor: Optional[Governor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> Optional[Governor]:
+    """The process-wide governor, or None if `[governor] rate` is 0."""
+    global _governor
+    if not config["governor"]["rate"]:
+        return None
+    with _governor_lock:
+        if _governor is None:
+            _governor = Governor()
+        return _governor
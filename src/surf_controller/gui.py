@@ -1,60 +1,268 @@
 import curses
 import subprocess
+from bisect import bisect_left
 import threading
 import time
+from collections import deque
+from contextlib import nullcontext
+from itertools import islice
 from pathlib import Path
 from typing import Optional
 
-from surf_controller.api import Action, Workspace, first_run
-from surf_controller.utils import config, logger
-from surf_controller import __version__
+from surf_controller.api import Action, ActionResult, Fleet, first_run, watch_changes
+from surf_controller.daemon import DaemonClient
+from surf_controller.fanout import FanOut, HostResult, has_ip, ssh_command, summarize
+from surf_controller.history import format_duration
+from surf_controller.metrics import metrics
+from surf_controller.registry import Change, Registry, matching
+from surf_controller.render import Screen
+from surf_controller.tail import LogTailer
+from surf_controller.utils import config, log_written, logger, setup_logger
+from surf_controller.waiter import Transition, Waiter
+from surf_controller.worker import Worker
+from surf_controller import __version__, setup_config
 
 class Controller:
     def __init__(self):
         self.scriptdir = Path.home() / config["files"]["scriptdir"]
         self.log_file = self.scriptdir / "logs.log"
         self.show_logs = False
+        self.show_metrics = False
+        self.show_output = False
+        # Lines printed by the last ssh fan-out, scrolled `output_scroll` lines up
+        self.output: deque = deque(maxlen=5000)
+        self.output_title = ""
+        self.output_scroll = 0
+        self.fanout: Optional[FanOut] = None
+        self.metrics_file = self.scriptdir / config["metrics"]["file"]
         self.logs = []
-        self.log_lock = threading.Lock()
-        self.URL = config["surf"]["URL"] + "/?application_type=Compute&deleted=false"
-        self.auth_token_file = self.scriptdir / config["files"]["api-token"]
-        if self.auth_token_file.exists():
-            self.AUTH_TOKEN = self.auth_token_file.read_text().strip()
-        else:
-            logger.warning(f"API token not found at {self.auth_token_file}")
         self.usernamefile = self.scriptdir / config["files"]["username"]
-        if self.usernamefile.exists():
-            self.username = self.usernamefile.read_text().strip()
-        else:
-            logger.warning(f"Username not found at {self.usernamefile}")
+        self.username = config.read("username")
+        if self.username is None:
+            logger.warning("Username not found at %s", self.usernamefile)
             self.username = ""
         self.OUTPUT_FILE = self.scriptdir / config["files"]["ids"]
-        self.workspace = Workspace()
-        self.action = Action()
-        self.vms: list = self.workspace.get_workspaces(save=True, username=self.username)
+        self.workspace = Fleet(cache=True)
+        self.action = Action(clients=self.workspace.clients)
+        # With a daemon running, the listing and the actions go through it
+        self.daemon = DaemonClient.connect()
+        self.waiter = Waiter(self.daemon or self.workspace)
+        self.vms = Registry()
+        # Positions in `vms` of the rows on screen, narrowed by the '/' search;
+        # `current_row` counts in here. `search_stack` has the view of every
+        # shorter query, so backspace does not search again.
+        self.view: list[int] = []
+        self.search = ""
+        self.searching = False
+        self.search_stack: list[list[int]] = []
+        # With `sort_idle`, the view is sorted by `idle`, when every paused
+        # workspace was first seen paused, from the history store
+        self.history = self.workspace.history
+        self.sort_idle = False
+        self.idle: dict = {}
         self.current_row = 0
         self.current_page = 0
-        self.selected = [False] * len(self.vms)
+        self.rows_per_page = 1
+        self.stale_ids: set = set()
+        self.fresh: list = []
+        self.loading = False
+        # Loads and the watch take turns on the workspace, see `watch`
+        self.fetch_lock = threading.Lock()
+        self.stop_watch = threading.Event()
+        self.watching = False
+        self.worker = Worker(threads=4)
+        self.actions_running = 0
+        self.quit_requested = False
+        self.status = ""
+        self.status_until = 0.0
+
+    def refresh(self, save: bool = False, update: bool = True) -> None:
+        """Reload the listing in the background.
+
+        Rows already on screen stay visible, marked as stale, until the new
+        listing confirms them. Pages are merged in as they arrive. When
+        attached to a daemon without `update`, its current listing is used.
+        """
+        if self.loading:
+            return
+        self.loading = True
+        self.stale_ids = {vm.id for vm in self.vms}
+        self.fresh = []
+        self.worker.submit(self.load, save, update)
+
+    def load(self, save: bool, update: bool = True) -> None:
+        complete = False
+        try:
+            if self.daemon:
+                username = self.username if self.workspace.filter else None
+                try:
+                    vms = self.daemon.get_workspaces(username, refresh=update)
+                except (OSError, ValueError) as e:
+                    logger.warning("Lost the daemon, using the API directly: %s", e)
+                    self.daemon = None
+                    self.waiter.workspace = self.workspace
+                else:
+                    self.worker.post(self.apply_page, vms)
+                    complete = True
+                    return
+            with self.fetch_lock, self.workspace.snapshot() if save else nullcontext() as snapshot:
+                for vms in self.workspace.iter_batches(self.username, snapshot):
+                    self.worker.post(self.apply_page, vms)
+                if snapshot and self.workspace.complete:
+                    self.workspace.commit(snapshot)
+                complete = self.workspace.complete
+        finally:
+            # Also after an error, or `loading` would block every later refresh
+            self.worker.post(self.finish_load, complete)
+
+    def start_watch(self) -> None:
+        """Start `watch` once, from the listing on screen, so its first poll
+        only brings what changed since."""
+        if self.watching:
+            return
+        self.watching = True
+        threading.Thread(target=self.watch, args=(list(self.vms),), daemon=True).start()
+
+    def watch(self, known: list) -> None:
+        """Keep the listing live in the background, see `apply_changes`.
+
+        Runs on its own thread. Holding `fetch_lock` while listing keeps the
+        changes in order with the pages of a reload.
+        """
+        for changes in watch_changes(self.poll, stopping=self.stop_watch, known=known):
+            self.worker.post(self.apply_changes, changes)
+
+    def poll(self) -> Optional[list]:
+        username = self.username if self.workspace.filter else None
+        if self.daemon:
+            try:
+                return self.daemon.get_workspaces(username)
+            except (OSError, ValueError) as e:
+                logger.warning("Watch: failed to list the daemon's workspaces: %s", e)
+                return None
+        with self.fetch_lock:
+            vms = self.workspace.get_workspaces(username=self.username)
+            return vms if self.workspace.complete else None
+
+    def apply_changes(self, changes: list[Change]) -> None:
+        vm_id = self.cursor_id()
+        moved = self.vms.apply(changes)
+        for change in changes:
+            self.stale_ids.discard(change.record.id)
+        if moved or self.search or self.sort_idle:
+            self.refilter()
+            self.move_cursor(vm_id)
+
+    def apply_page(self, vms: list) -> None:
+        self.fresh.extend(vms)
+        fresh_ids = {vm.id for vm in self.fresh}
+        self.stale_ids -= fresh_ids
+        self.set_vms(self.fresh + [vm for vm in self.vms if vm.id in self.stale_ids])
+
+    def finish_load(self, complete: bool) -> None:
+        self.loading = False
+        if complete:
+            # Rows the new listing did not confirm no longer exist
+            self.set_vms(self.fresh)
+            self.stale_ids = set()
+        else:
+            self.show_status_message("Failed to update the VM list, see logs")
+        # The first load lists the whole fleet already, the watch goes on from there
+        self.start_watch()
+
+    def set_logs(self, lines: list) -> None:
+        self.logs = lines
+
+    def set_vms(self, vms: list) -> None:
+        vm_id = self.cursor_id()
+        self.vms.replace(vms)
+        self.refilter()
+        self.move_cursor(vm_id)
 
-    def refresh(self) -> None:
-        self.vms = self.workspace.get_workspaces(save=False, username=self.username)
+    def cursor_id(self) -> Optional[str]:
+        if self.current_row >= len(self.view):
+            return None
+        return self.vms[self.view[self.current_row]].id
+
+    def move_cursor(self, vm_id: Optional[str]) -> None:
+        """Put the cursor back on `vm_id` after the rows moved, if it is shown."""
+        position = self.vms.by_id.get(vm_id)
+        if position is not None and self.sort_idle:
+            if position in self.view:
+                self.current_row = self.view.index(position)
+        elif position is not None:
+            # `view` is in listing order
+            row = bisect_left(self.view, position)
+            if row < len(self.view) and self.view[row] == position:
+                self.current_row = row
+        self.current_page = self.current_row // self.rows_per_page
+
+    def refilter(self) -> None:
+        """Apply the search to the listing again, after it changed."""
+        if self.search:
+            self.view = self.vms.search(self.search)
+        else:
+            self.view = list(range(len(self.vms)))
+        if self.sort_idle:
+            self.idle = self.history.idle_since()
+            # Longest idle first, running and unknown workspaces last
+            never = float("inf")
+            self.view.sort(key=lambda idx: self.idle.get(self.vms[idx].id, never))
+        self.search_stack = []
+        self.current_row = min(self.current_row, max(len(self.view) - 1, 0))
+
+    def set_search(self, query: str) -> None:
+        if query.startswith(self.search) and query != self.search:
+            # A longer query only matches rows that matched the shorter one
+            self.search_stack.append(self.view)
+            self.view = self.vms.search(query, within=self.view)
+        elif self.search_stack and len(query) == len(self.search) - 1:
+            self.view = self.search_stack.pop()
+        else:
+            # from scratch, sorted by idle time if that is on
+            self.search = query
+            self.refilter()
+        self.search = query
         self.current_row = 0
-        self.selected = [False] * len(self.vms)
-        self.stdscr.refresh()
+        self.current_page = 0
 
-    def rename_user(self) -> None:
+    def search_key(self, key: int) -> None:
+        """Handle a key while the search is being typed."""
+        if key in (ord("\n"), curses.KEY_ENTER):
+            self.searching = False
+        elif key == 27:  # Escape
+            self.searching = False
+            self.set_search("")
+        elif key in (curses.KEY_BACKSPACE, 127, 8):
+            if self.search:
+                self.set_search(self.search[:-1])
+            else:
+                self.searching = False
+        elif 32 <= key < 127:
+            self.set_search(self.search + chr(key))
+
+    def prompt(self, header: str, question: str) -> str:
         self.stdscr.clear()
-        self.stdscr.addstr(0, 0, f"Current username: {self.username}")
-        self.stdscr.addstr(2, 0, "Enter new username: ")
+        self.stdscr.addstr(0, 0, header)
+        self.stdscr.addstr(2, 0, question)
         self.stdscr.refresh()
         curses.echo()
-        new_username = self.stdscr.getstr(2, 20).decode("utf-8")
+        self.stdscr.timeout(-1)
+        answer = self.stdscr.getstr(2, len(question)).decode("utf-8")
+        self.stdscr.timeout(100)
         curses.noecho()
+        self.screen.invalidate()
+        return answer
+
+    def rename_user(self) -> None:
+        new_username = self.prompt(
+            f"Current username: {self.username}", "Enter new username: "
+        )
         if new_username:
             self.username = new_username
             self.usernamefile.write_text(new_username)
             self.show_status_message(f"Username updated to: {new_username}")
-            logger.info(f"Username updated to: {new_username}")
+            logger.info("Username updated to: %s", new_username)
         else:
             self.show_status_message("Username unchanged")
 
@@ -68,25 +276,61 @@ class Controller:
         curses.init_pair(3, curses.COLOR_BLUE, curses.COLOR_BLACK)
         curses.init_pair(4, curses.COLOR_WHITE, curses.COLOR_BLACK)
 
-        self.stdscr.clear()
+        self.screen = Screen(self.stdscr)
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        # Escape ends a search, don't wait a second for an escape sequence
+        curses.set_escdelay(25)
 
-        def update_logs():
+        tailer = LogTailer(self.log_file, lines=10, changed=log_written)
+        log_thread = threading.Thread(
+            target=tailer.follow,
+            args=(lambda lines: self.worker.post(self.set_logs, lines),),
+            daemon=True,
+        )
+        log_thread.start()
+
+        def save_metrics():
             while True:
-                with open(self.log_file, "r") as f:
-                    new_logs = f.readlines()[-10:]
-                with self.log_lock:
-                    self.logs = new_logs
-                time.sleep(1)  # Check for new logs every second
+                time.sleep(config["metrics"]["interval"])
+                metrics.write(self.metrics_file)
 
-        log_thread = threading.Thread(target=update_logs, daemon=True)
-        log_thread.start()
+        threading.Thread(target=save_metrics, daemon=True).start()
 
+        # Start from the cached listing and only go to the network when it has expired
+        self.set_vms(self.workspace.cached(self.username))
+        if self.daemon:
+            self.show_status_message(f"Attached to the daemon at {self.daemon.path}")
+            self.refresh(update=False)
+        elif not self.workspace.fresh():
+            self.refresh(save=True)
+        if not self.loading:
+            self.start_watch()
         self.print_menu()
 
+        # getch gives up after 100ms, so results from the worker are drawn
+        # even when no key is pressed
+        self.stdscr.timeout(100)
         while True:
             key = self.stdscr.getch()
-            if key == ord("j") and self.current_row < len(self.vms) - 1:
-                if self.current_row < len(self.vms) - 1:
+            dirty = self.worker.drain()
+            if self.status and time.monotonic() > self.status_until:
+                self.status = ""
+                dirty = True
+            if key == -1:
+                if dirty:
+                    self.print_menu()
+                continue
+            if self.searching:
+                self.search_key(key)
+                self.print_menu()
+                continue
+            if key != ord("q"):
+                self.quit_requested = False
+            if key == ord("j") and self.current_row < len(self.view) - 1:
+                if self.current_row < len(self.view) - 1:
                     self.current_row += 1
                     # Go to the next page if necessary
                     if self.current_row >= (self.current_page + 1) * self.rows_per_page:
@@ -94,7 +338,9 @@ class Controller:
             elif key == ord("J"):
                 if self.current_page < self.max_pages:
                     self.current_page += 1
-                    self.current_row = self.current_page * self.rows_per_page
+                    self.current_row = min(
+                        self.current_page * self.rows_per_page, max(len(self.view) - 1, 0)
+                    )
             elif key == ord("k") and self.current_row > 0:
                 if self.current_row > 0:
                     self.current_row -= 1
@@ -106,44 +352,76 @@ class Controller:
                     self.current_page -= 1
                     self.current_row = self.current_page * self.rows_per_page
             elif key == ord("\n"):  # Enter key
-                self.selected[self.current_row] = not self.selected[self.current_row]
-            elif key == ord("a"):  # Select all
-                if all(self.selected):
-                    self.selected = [False] * len(self.vms)
+                if self.view:
+                    self.vms.toggle(self.vms[self.view[self.current_row]].id)
+            elif key == ord("a"):  # Select all shown
+                self.vms.toggle_all(self.vms[idx].id for idx in self.view)
+            elif key == ord("i"):  # Sort by idle time
+                if self.history is None:
+                    self.show_status_message("No history is kept, set [history] file")
                 else:
-                    self.selected = [True] * len(self.vms)
+                    self.sort_idle = not self.sort_idle
+                    self.refilter()
+                    self.current_row = self.current_page = 0
+                    order = "idle longest first" if self.sort_idle else "listing order"
+                    self.show_status_message(f"Sorted by {order}")
+            elif key == ord("/"):  # Search by name
+                self.searching = True
+            elif key == 27 and self.search:  # Escape clears the search
+                self.set_search("")
             elif key == ord("f"):  # Filter VMs
                 self.workspace.filter = not self.workspace.filter
                 self.show_status_message(f"Toggle filtering for: {self.username}")
-                self.refresh()
+                if self.workspace.filter:
+                    # The listing on screen has everything the filter keeps
+                    self.set_vms(list(matching(self.vms, user=self.username)))
+                else:
+                    self.refresh()
             elif key == ord("u"):  # Update VM list
                 self.show_status_message("Updating VM list...\n")
                 logger.info("Updated VM list...")
                 self.refresh()
+            elif key in (ord("p"), ord("r")) and not self.vms.selected:
+                self.show_status_message("No VM selected to pause or resume")
             elif key == ord("p"):
-                idlist = [
-                    self.vms[i].name for i in range(len(self.vms)) if self.selected[i]
-                ]
-                self.show_status_message(f"Pausing {idlist}...\n")
-                self.action("pause", self.vms, idlist)
-                time.sleep(5)
-                self.refresh()
+                names = [vm.name for vm in self.vms.selection()]
+                self.show_status_message(f"Pausing {names}...\n")
+                self.start_action("pause", set(self.vms.selected))
             elif key == ord("r"):  # Resume selected VMs
-                idlist = [
-                    self.vms[i].name for i in range(len(self.vms)) if self.selected[i]
-                ]
-                logger.info(f"Resuming {idlist}...\n")
-                self.show_status_message(f"Resuming {idlist}...")
-
-                self.action("resume", self.vms, idlist)
-                time.sleep(5)
-                self.refresh()
+                names = [vm.name for vm in self.vms.selection()]
+                logger.info("Resuming %s...\n", names)
+                self.show_status_message(f"Resuming {names}...")
+                self.start_action("resume", set(self.vms.selected))
             elif key == ord("n"):  # Rename user
                 self.rename_user()
             elif key == ord("l"):  # Toggle logs
                 self.show_logs = not self.show_logs
+                self.show_metrics = self.show_output = False
+            elif key == ord("m"):  # Toggle metrics
+                self.show_metrics = not self.show_metrics
+                self.show_logs = self.show_output = False
+            elif key == ord("o"):  # Toggle ssh output
+                self.show_output = not self.show_output
+                self.show_logs = self.show_metrics = False
+            elif key == curses.KEY_PPAGE and self.show_output:
+                self.output_scroll = min(self.output_scroll + 10, max(len(self.output) - 10, 0))
+            elif key == curses.KEY_NPAGE and self.show_output:
+                self.output_scroll = max(self.output_scroll - 10, 0)
+            elif key == ord("x"):  # Run a command on the selected VMs
+                selected_vms = self.vms.selection()
+                if not selected_vms:
+                    self.show_status_message("No VM selected to run a command on")
+                elif self.fanout:
+                    self.show_status_message("A command is still running")
+                else:
+                    command = self.prompt(
+                        f"Run a command over ssh on {len(selected_vms)} VMs",
+                        "Command: ",
+                    )
+                    if command:
+                        self.start_fanout(command, selected_vms)
             elif key == ord("s"):  # SSH into selected VM
-                selected_vms = [vm for i, vm in enumerate(self.vms) if self.selected[i]]
+                selected_vms = self.vms.selection()
                 if len(selected_vms) == 1:
                     self.ssh_to_vm(selected_vms[0])
                 elif len(selected_vms) > 1:
@@ -151,104 +429,247 @@ class Controller:
                 else:
                     self.show_status_message("No VM selected for SSH")
             elif key == ord("q"):  # Quit
-                break
+                if not self.actions_running or self.quit_requested:
+                    break
+                self.quit_requested = True
+                self.show_status_message(
+                    "Actions are still running, press 'q' again to cancel them and quit"
+                )
             self.print_menu()
 
+        self.stop_watch.set()
+        self.action.stop()
+        self.waiter.stop()
+        if self.fanout:
+            self.fanout.stop()
+        metrics.write(self.metrics_file)
+
     def print_menu(self) -> None:
-        self.stdscr.clear()
+        with metrics.timer("tui_frame_seconds"):
+            self.draw_menu()
+
+    def draw_menu(self) -> None:
         v = str(__version__)
         footlen = 10
 
         # Calculate the number of rows that can fit on the screen
         max_y, max_x = self.stdscr.getmaxyx()
         # Adjust for space taken by logs or footer
-        self.rows_per_page = max_y - footlen - 12 if self.show_logs else max_y - footlen
-        self.max_pages = len(self.vms) // self.rows_per_page
+        panel = self.show_logs or self.show_metrics or self.show_output
+        self.rows_per_page = max_y - footlen - 12 if panel else max_y - footlen
+        self.rows_per_page = max(self.rows_per_page, 1)
+        self.max_pages = len(self.view) // self.rows_per_page
 
+        search = ""
+        if self.search:
+            search = f" == Search: {self.search} ({len(self.view)} of {len(self.vms)})"
         footer_text = (
             f"== Username {'(filter)' if self.workspace.filter else ''}: {self.username}"
-            f" == surfcontroller version {v} == Page {self.current_page + 1} of {self.max_pages + 1} ==\n"
+            f" == surfcontroller version {v} == Page {self.current_page + 1} of {self.max_pages + 1}{search} ==\n"
             "Press \n'j' to move down, 'k' to move up,"
             "'J' to move to next page,'K' to move to previous page,\n"
-            "'Enter' to select,'a' to select all,\n"
-            "'f' to toggle filter,'n' to rename user,\n"
+            "'Enter' to select,'a' to select all shown,'/' to search,'Esc' to clear it,\n"
+            "'f' to toggle filter,'i' to sort by idle time,'n' to rename user,\n"
             "'p' to pause,'r' to resume,'u' to update status,"
-            "'s' for ssh access,\n 'l' to toggle logs,'q' to quit\n"
+            "'s' for ssh access,'x' to run a command on selected,\n"
+            " 'l' to toggle logs,'m' to toggle metrics,'o' to toggle command output,'q' to quit\n"
         )
-        footlen = len(footer_text.split('\n'))
-
-        # Determine the current page's start and end indices
-        start_index = self.current_page * self.rows_per_page
-        end_index = min(start_index + self.rows_per_page, len(self.vms))
 
-        # Display the VMs for the current page
-        for idx in range(start_index, end_index):
-            vm = self.vms[idx]
-            mark = "[*] " if self.selected[idx] else "[ ] "
+        rows = []
+        now = time.time()
+        for idx, position in enumerate(self.view):
+            vm = self.vms[position]
+            mark = "[*] " if vm.id in self.vms.selected else "[ ] "
             status = "running" if vm.active else "paused"
             line = mark + vm.name + f"({status})"
+            if vm.account:
+                line += f" [{vm.account}]"
+            if self.sort_idle and vm.id in self.idle:
+                line += f" idle {format_duration(now - self.idle[vm.id])}"
             colornumber = 1 if vm.active else 4
-
-            display_idx = idx - start_index  # Adjust index for display on current page
+            attr = 0
+            if vm.id in self.stale_ids:
+                line += " (stale)"
+                attr = curses.A_DIM
             if idx == self.current_row:
-                try:
-                    self.stdscr.addstr(display_idx, 0, line, curses.color_pair(2) | curses.A_REVERSE)
-
-                    # self.stdscr.addstr(display_idx, 0, line, curses.A_REVERSE)
-                except curses.error as e:
-                    logger.debug(f"Error highlighting line {idx}: {line}, {e}")
+                rows.append((line, curses.color_pair(2) | curses.A_REVERSE))
             else:
-                try:
-                    self.stdscr.addstr(display_idx, 0, line, curses.color_pair(colornumber))
-                except curses.error as e:
-                    logger.debug(f"Error displaying line {idx}: {line}, {e}")
+                rows.append((line, curses.color_pair(colornumber) | attr))
 
-        # Display pagination and control information
-        try:
-            self.stdscr.addstr(self.rows_per_page, 0, footer_text)
-        except curses.error as e:
-            logger.debug(f"Error print menu: {e}")
+        # The footer window starts below the VM list, wrap its text to the screen
+        footer_height = max_y - self.rows_per_page
+        footer = [("", 0)] * footer_height
+        y = 0
+        for text in footer_text.split("\n"):
+            for start in range(0, max(len(text), 1), max_x - 1):
+                if y < footer_height:
+                    footer[y] = (text[start : start + max_x - 1], 0)
+                y += 1
 
         # Display logs if enabled
-        if self.show_logs:
-            try:
-                self.stdscr.addstr(max_y - 12, 0, "===logs===")
-                for idx, log in enumerate(self.logs[-10:]):
-                    self.stdscr.addstr(max_y - 11 + idx, 0, log)
-            except curses.error as e:
-                logger.debug(f"Error displaying logs: {e}")
+        if self.show_logs and footer_height >= 12:
+            footer[footer_height - 12] = ("===logs===", 0)
+            for idx, log in enumerate(self.logs[-10:]):
+                footer[footer_height - 11 + idx] = (log, 0)
+        elif self.show_metrics and footer_height >= 12:
+            footer[footer_height - 12] = ("===metrics===", 0)
+            for idx, line in enumerate(metrics.summary()[:10]):
+                footer[footer_height - 11 + idx] = (line, 0)
+        elif self.show_output and footer_height >= 12:
+            title = self.output_title or "no command run yet, select VMs and press 'x'"
+            if self.output_scroll:
+                title += f" (scrolled up {self.output_scroll} lines, PgDn to follow)"
+            footer[footer_height - 12] = (f"==={title}===", 0)
+            end = len(self.output) - self.output_scroll
+            for idx, line in enumerate(islice(self.output, max(end - 10, 0), end)):
+                footer[footer_height - 11 + idx] = (line, 0)
 
-        self.stdscr.refresh()
+        if self.searching:
+            footer[footer_height - 1] = (f"/{self.search}", curses.A_BOLD)
+        elif self.status:
+            footer[footer_height - 1] = (self.status, curses.A_BOLD)
+
+        self.screen.draw(
+            rows,
+            top=self.current_page * self.rows_per_page,
+            list_height=self.rows_per_page,
+            footer=footer,
+        )
 
     def show_status_message(self, message) -> None:
+        # Shown on the bottom line by print_menu until it expires
+        self.status = message.strip()
+        self.status_until = time.monotonic() + 3
+
+    def show_action_results(self, do: str, results: list[ActionResult]) -> None:
+        failed = [result for result in results if not result.ok]
+        if failed:
+            names = ", ".join(
+                f"{result.name} ({result.status_code or 'no response'})"
+                for result in failed
+            )
+            self.show_status_message(
+                f"{do}: {len(results) - len(failed)}/{len(results)} succeeded, failed: {names}"
+            )
+        else:
+            self.show_status_message(f"{do}: {len(results)}/{len(results)} succeeded")
+
+    def start_action(self, do: str, ids: set) -> None:
+        self.actions_running += 1
+        self.worker.submit(self.run_action, do, list(self.vms), ids)
+
+    def run_action(self, do: str, vms: list, ids: set) -> None:
+        # Runs on the worker, everything that touches the screen is posted back
+        targets = []
         try:
-            self.stdscr.addstr(len(self.vms) + 1, 0, message)
-        except curses.error as e:
-            logger.debug(f"Error displaying status message: {e}")
-        self.stdscr.refresh()
-        time.sleep(2)  # Show the message for 2 seconds
+            if self.daemon:
+                results = self.daemon.run_action(do, ids)
+            else:
+                results = self.action(do, vms, ids)
+            self.worker.post(self.show_action_results, do, results)
+            ids = {result.id for result in results if result.ok}
+            targets = [vm for vm in vms if vm.id in ids]
+        finally:
+            if targets:
+                # Following the transitions takes up to `[wait] timeout`; on a
+                # thread of its own it leaves the workers free for reloads
+                threading.Thread(
+                    target=self.follow, args=(targets, do == "resume"), daemon=True
+                ).start()
+            else:
+                self.worker.post(self.finish_action)
+
+    def follow(self, targets: list, active: bool) -> None:
+        try:
+            transitions = self.waiter(
+                targets,
+                active,
+                on_settled=lambda t: self.worker.post(self.update_row, t),
+            )
+            self.worker.post(self.show_transitions, transitions)
+        except Exception:
+            logger.exception("Failed to follow %d VMs to their new state", len(targets))
+        finally:
+            self.worker.post(self.finish_action)
+
+    def finish_action(self) -> None:
+        self.actions_running -= 1
+
+    def show_transitions(self, transitions: list[Transition]) -> None:
+        settled = [t for t in transitions if t.settled]
+        message = f"{len(settled)}/{len(transitions)} VMs reached the new state"
+        if settled:
+            message += f" (slowest {max(t.elapsed for t in settled):.1f}s)"
+        self.show_status_message(message)
+
+    def update_row(self, transition: Transition) -> None:
+        if transition.workspace is None:
+            return
+        self.vms.update(transition.workspace)
+        self.stale_ids.discard(transition.id)
+        if self.search:
+            # a rename can move it in or out of the search
+            self.refilter()
+
+    def start_fanout(self, command: str, vms: list) -> None:
+        self.output.clear()
+        self.output_scroll = 0
+        self.output_title = f"{command} on {len(vms)} VMs"
+        self.show_output = True
+        self.show_logs = self.show_metrics = False
+        self.actions_running += 1
+        self.fanout = FanOut(
+            command,
+            on_line=lambda vm, line: self.worker.post(self.add_output, f"{vm.name} | {line}"),
+        )
+        self.worker.submit(self.run_fanout, self.fanout, vms)
+
+    def run_fanout(self, fanout: FanOut, vms: list) -> None:
+        # Runs on the worker, like run_action
+        results = []
+        try:
+            for result in fanout.run(vms):
+                results.append(result)
+                status = result.error or f"exit {result.exit_code}"
+                self.worker.post(self.add_output, f"{result.name} | --- {status}")
+        finally:
+            self.worker.post(self.finish_fanout, results)
+
+    def add_output(self, line: str) -> None:
+        self.output.append(line)
+        if self.output_scroll:
+            # keep the lines in view while scrolled up
+            self.output_scroll += 1
+
+    def finish_fanout(self, results: list[HostResult]) -> None:
+        self.fanout = None
+        self.actions_running -= 1
+        self.output_title += f": {summarize(results)}"
+        self.show_status_message(summarize(results))
 
     def ssh_to_vm(self, vm):
-        if vm.ip:
-            logger.info(f"Connecting to {vm.name} at {vm.ip}...")
+        if has_ip(vm):
+            logger.info("Connecting to %s at %s...", vm.name, vm.ip)
             self.show_status_message(f"Connecting to {vm.name} at {vm.ip}...")
-            ssh_command = f"ssh {vm.ip}"
 
             try:
                 # Use curses.endwin() to temporarily suspend curses
                 curses.endwin()
-                subprocess.run(ssh_command, shell=True)
+                subprocess.run(ssh_command(vm.ip))
             except Exception as e:
-                logger.error(f"SSH connection failed: {str(e)}")
+                logger.error("SSH connection failed: %s", e)
             finally:
                 # Reinitialize curses
-                self.stdscr.refresh()
+                self.screen.invalidate()
                 logger.info("SSH connection closed")
         else:
             self.show_status_message(f"No IP address available for {vm.name}")
 
 
 def main():
+    setup_config()
+    print(f"Welcome to surf_controller version {__version__}")
+    setup_logger()
     curses.wrapper(first_run)
     controller = Controller()
     curses.wrapper(controller)
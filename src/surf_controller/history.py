@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from surf_controller.utils import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transitions (
+    workspace_id TEXT NOT NULL,
+    time REAL NOT NULL,
+    active INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    account TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS transitions_by_id ON transitions (workspace_id, time);
+CREATE TABLE IF NOT EXISTS current (
+    workspace_id TEXT PRIMARY KEY,
+    active INTEGER NOT NULL,
+    since REAL NOT NULL,
+    name TEXT NOT NULL
+);
+"""
+
+
+class History:
+    """Every state change seen in a listing, in SQLite, for uptime queries.
+
+    `observe` only writes when a workspace is seen in a state other than the
+    last one recorded, so polling an unchanged fleet costs a dict lookup per
+    workspace. `current` holds the latest state of every workspace and the
+    time it started, `transitions` the full record, indexed by workspace id
+    and time. A state is assumed to last until the next one is observed.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or config.scriptdir / config["history"]["file"]
+        # Listings are parsed on the threads of the waiter and the fleet
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.known = {
+            workspace_id: bool(active)
+            for workspace_id, active in self.db.execute("SELECT workspace_id, active FROM current")
+        }
+
+    def close(self) -> None:
+        self.db.close()
+
+    def observe(self, vms: Iterable, at: Optional[float] = None) -> int:
+        """Record the workspaces in `vms` whose state changed; returns how many."""
+        changed = [vm for vm in vms if self.known.get(vm.id) != vm.active]
+        if not changed:
+            return 0
+        at = at or time.time()
+        with self.lock, self.db:
+            for vm in changed:
+                # Another process may have seen the same change already
+                self.db.execute(
+                    "INSERT INTO transitions (workspace_id, time, active, name, account)"
+                    " SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS"
+                    " (SELECT 1 FROM current WHERE workspace_id = ? AND active = ?)",
+                    (vm.id, at, vm.active, vm.name, vm.account, vm.id, vm.active),
+                )
+                self.db.execute(
+                    "INSERT INTO current (workspace_id, active, since, name) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (workspace_id) DO UPDATE SET"
+                    " since = excluded.since, active = excluded.active, name = excluded.name"
+                    " WHERE active != excluded.active",
+                    (vm.id, vm.active, at, vm.name),
+                )
+                self.known[vm.id] = vm.active
+        return len(changed)
+
+    def uptime(self, start: float, end: Optional[float] = None) -> dict[str, float]:
+        """Seconds every workspace was running between `start` and `end`."""
+        end = end or time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT workspace_id,"
+                " SUM(MAX(0, MIN(COALESCE(next, :end), :end) - MAX(time, :start)))"
+                " FROM (SELECT workspace_id, time, active,"
+                " LEAD(time) OVER (PARTITION BY workspace_id ORDER BY time) AS next"
+                " FROM transitions WHERE time < :end)"
+                " WHERE active GROUP BY workspace_id",
+                {"start": start, "end": end},
+            ).fetchall()
+        return dict(rows)
+
+    def idle_since(self) -> dict[str, float]:
+        """When every paused workspace was first seen paused, by id."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT workspace_id, since FROM current WHERE NOT active"
+            ).fetchall()
+        return dict(rows)
+
+    def last_active(self) -> dict[str, Optional[float]]:
+        """When every workspace was last seen running: now for the running
+        ones, None for those never seen running."""
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT workspace_id, CASE WHEN active THEN ?"
+                " WHEN EXISTS (SELECT 1 FROM transitions"
+                " WHERE transitions.workspace_id = current.workspace_id AND active)"
+                " THEN since END FROM current",
+                (now,),
+            ).fetchall()
+        return dict(rows)
+
+    def names(self) -> dict[str, str]:
+        with self.lock:
+            return dict(self.db.execute("SELECT workspace_id, name FROM current").fetchall())
+
+
+_history: Optional[History] = None
+_history_lock = threading.Lock()
+
+
+def get_history() -> Optional[History]:
+    """The shared history store, or None if `[history] file` is empty."""
+    global _history
+    if not config["history"]["file"]:
+        return None
+    with _history_lock:
+        if _history is None:
+            _history = History()
+        return _history
+
+
+def format_duration(seconds: float) -> str:
+    """`seconds` as the two largest units, e.g. "3d 4h" or "12m"."""
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
@@ -0,0 +1,166 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from surf_controller.utils import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    action TEXT NOT NULL,
+    selector TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    job INTEGER NOT NULL REFERENCES jobs (id),
+    workspace_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    account TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status_code INTEGER,
+    error TEXT,
+    updated REAL,
+    PRIMARY KEY (job, workspace_id)
+);
+"""
+
+
+class Journal:
+    """Durable record of bulk pause/resume jobs, in SQLite.
+
+    A job is the list of calls planned for one run, each `pending` until it
+    comes back `done` or `failed`, with its attempts and last outcome. Every
+    outcome is committed as it arrives, so when a run dies halfway the job
+    shows which calls still have to be made, and `pending` hands out only
+    those for the next attempt.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or config.scriptdir / config["journal"]["file"]
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def create(self, action: str, vms: Iterable, selector: dict) -> int:
+        """Plan `action` on every workspace in `vms`; returns the job id."""
+        with self.db:
+            job = self.db.execute(
+                "INSERT INTO jobs (action, selector, created) VALUES (?, ?, ?)",
+                (action, json.dumps(selector, sort_keys=True), time.time()),
+            ).lastrowid
+            self.db.executemany(
+                "INSERT INTO calls (job, workspace_id, name, account) VALUES (?, ?, ?, ?)",
+                [(job, vm.id, vm.name, vm.account) for vm in vms],
+            )
+        return job
+
+    def job(self, job: Optional[int] = None, action: Optional[str] = None) -> Optional[dict]:
+        """Job `job`, or the latest unfinished `action` job."""
+        if job is not None:
+            row = self.db.execute(
+                "SELECT id, action, selector, created, finished FROM jobs WHERE id = ?", (job,)
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                "SELECT id, action, selector, created, finished FROM jobs"
+                " WHERE action = ? AND finished IS NULL ORDER BY id DESC LIMIT 1",
+                (action,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "action": row[1],
+            "selector": json.loads(row[2]),
+            "created": row[3],
+            "finished": row[4],
+        }
+
+    def pending(self, job: int) -> list[str]:
+        """Ids of the workspaces whose call in `job` has not succeeded yet."""
+        rows = self.db.execute(
+            "SELECT workspace_id FROM calls WHERE job = ? AND state != 'done' ORDER BY rowid",
+            (job,),
+        )
+        return [row[0] for row in rows]
+
+    def recent(self, since: float) -> dict[str, str]:
+        """The action each workspace was last brought to successfully after
+        `since`, by workspace id."""
+        rows = self.db.execute(
+            "SELECT workspace_id, action FROM calls JOIN jobs ON calls.job = jobs.id"
+            " WHERE state = 'done' AND updated > ? ORDER BY updated",
+            (since,),
+        )
+        return dict(rows.fetchall())
+
+    def record(self, job: int, result) -> None:
+        """Store the outcome of one call, an `ActionResult`."""
+        with self.db:
+            self.db.execute(
+                "UPDATE calls SET state = ?, attempts = attempts + 1, status_code = ?,"
+                " error = ?, updated = ? WHERE job = ? AND workspace_id = ?",
+                (
+                    "done" if result.ok else "failed",
+                    result.status_code,
+                    result.error,
+                    time.time(),
+                    job,
+                    result.id,
+                ),
+            )
+
+    def settle(self, job: int, workspace_id: str, state: str, error: Optional[str]) -> None:
+        """Close a call without making it, e.g. because the workspace is in
+        the wanted state already (`done`) or no longer exists (`failed`)."""
+        with self.db:
+            self.db.execute(
+                "UPDATE calls SET state = ?, error = ?, updated = ?"
+                " WHERE job = ? AND workspace_id = ?",
+                (state, error, time.time(), job, workspace_id),
+            )
+
+    def finish(self, job: int) -> bool:
+        """Mark `job` finished if all its calls are done; returns whether it is."""
+        with self.db:
+            left = self.db.execute(
+                "SELECT COUNT(*) FROM calls WHERE job = ? AND state != 'done'", (job,)
+            ).fetchone()[0]
+            if not left:
+                self.db.execute(
+                    "UPDATE jobs SET finished = ? WHERE id = ? AND finished IS NULL",
+                    (time.time(), job),
+                )
+        return not left
+
+    def jobs(self, limit: int = 20) -> list[dict]:
+        """The latest jobs with the number of calls in every state."""
+        rows = self.db.execute(
+            "SELECT jobs.id, action, selector, created, finished,"
+            " COUNT(calls.workspace_id),"
+            " SUM(state = 'done'), SUM(state = 'failed'), SUM(state = 'pending')"
+            " FROM jobs LEFT JOIN calls ON calls.job = jobs.id"
+            " GROUP BY jobs.id ORDER BY jobs.id DESC LIMIT ?",
+            (limit,),
+        )
+        return [
+            {
+                "id": id,
+                "action": action,
+                "selector": json.loads(selector),
+                "created": created,
+                "finished": finished,
+                "calls": calls,
+                "done": done or 0,
+                "failed": failed or 0,
+                "pending": pending or 0,
+            }
+            for id, action, selector, created, finished, calls, done, failed, pending in rows
+        ]
@@ -0,0 +1,199 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+# upper bounds in seconds; the last bucket counts everything above
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket that holds the q-th quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Latency histograms and counters, labelled like Prometheus metrics.
+
+    Recording takes a lock and a bisect, so it is cheap enough to leave on.
+    `snapshot` gives a JSON-friendly view, `prometheus` the text format, and
+    `write` saves either one depending on the file suffix.
+    """
+
+    def __init__(self):
+        self.histograms: dict = {}
+        self.counters: dict = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)),
+                }
+                for (name, labels), h in self.histograms.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.counters.items()
+            ]
+        return {"time": time.time(), "histograms": histograms, "counters": counters}
+
+    def prometheus(self) -> str:
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {h.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{fmt(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        if path.suffix == ".json":
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.prometheus()
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        os.chmod(fd, 0o644)
+        with os.fdopen(fd, "w") as file:
+            file.write(text)
+        os.replace(tmp, path)
+
+    def summary(self) -> list[str]:
+        """Short lines for the TUI overlay."""
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        for (name, labels), h in histograms:
+            label = " ".join(str(v) for _, v in labels)
+            lines.append(
+                f"{name} {label}: n={h.count} avg={h.sum / h.count * 1000:.1f}ms "
+                f"p50<={h.quantile(0.5) * 1000:g}ms p95<={h.quantile(0.95) * 1000:g}ms"
+            )
+        for (name, labels), value in counters:
+            label = " ".join(str(v) for _, v in labels)
+            lines.append(f"{name} {label}: {value}")
+        return lines
+
+
+class Profiler:
+    """cProfile for a whole session.
+
+    cProfile only sees the thread that enabled it, so the main thread gets one
+    profile and background jobs wrap themselves in `thread()`; all of them are
+    merged into one stats file by `stop`.
+    """
+
+    def __init__(self):
+        self.main = None
+        self.profiles: list = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.main is not None
+
+    def start(self) -> None:
+        import cProfile
+
+        self.main = cProfile.Profile()
+        self.main.enable()
+
+    @contextmanager
+    def thread(self):
+        if not self.enabled:
+            yield
+            return
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def stop(self, path: Path) -> None:
+        import pstats
+
+        self.main.disable()
+        stats = pstats.Stats(self.main)
+        with self.lock:
+            for profile in self.profiles:
+                stats.add(profile)
+        stats.dump_stats(path)
+        self.main = None
+
+
+metrics = Metrics()
+profiler = Profiler()
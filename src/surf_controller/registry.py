@@ -0,0 +1,215 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+
+class WorkspaceRecord:
+    """One workspace as shown in the controller.
+
+    Uses `__slots__`, so a listing of thousands of workspaces costs a few
+    pointers per record instead of a dict each. `account` is the name of the
+    `[accounts]` entry it was listed with, empty for the default tokens.
+    """
+
+    __slots__ = ("id", "name", "active", "ip", "account")
+    FIELDS = ("id", "name", "active", "ip")
+
+    def __init__(self, id: str, name: str, active: bool, ip: str, account: str = ""):
+        self.id = id
+        self.name = name
+        self.active = active
+        self.ip = ip
+        self.account = account
+
+    @classmethod
+    def from_result(cls, result: dict, account: str = "") -> "WorkspaceRecord":
+        """Build a record from one item of the workspace API."""
+        ip = result["resource_meta"].get("ip", "Not available")
+        return cls(result["id"], result["name"], result["active"], ip, account)
+
+    def as_dict(self) -> dict:
+        record = {"id": self.id, "name": self.name, "active": self.active, "ip": self.ip}
+        if self.account:
+            record["account"] = self.account
+        return record
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, WorkspaceRecord):
+            return NotImplemented
+        return (self.id, self.name, self.active, self.ip, self.account) == (
+            other.id,
+            other.name,
+            other.active,
+            other.ip,
+            other.account,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"WorkspaceRecord(id={self.id!r}, name={self.name!r}, "
+            f"active={self.active!r}, ip={self.ip!r}, account={self.account!r})"
+        )
+
+
+@dataclass
+class Change:
+    """One difference between two listings: `kind` is "added", "removed" or
+    "changed", `record` the workspace as it is now (or was, when removed)."""
+
+    kind: str
+    record: WorkspaceRecord
+
+
+def diff(before: dict, after: Iterable[WorkspaceRecord]) -> list[Change]:
+    """The changes from the records in `before`, keyed by id, to `after`."""
+    changes = []
+    seen = set()
+    for record in after:
+        seen.add(record.id)
+        old = before.get(record.id)
+        if old is None:
+            changes.append(Change("added", record))
+        elif old != record:
+            changes.append(Change("changed", record))
+    changes.extend(Change("removed", record) for id, record in before.items() if id not in seen)
+    return changes
+
+
+class Registry:
+    """The workspaces on screen, in listing order, indexed by id and by name.
+
+    Selection is a set of ids, so it survives reloads and reordering, and two
+    workspaces with the same name are never mixed up. Lookups, toggles and
+    bulk selection are O(1) per workspace. The lowercased names are kept in
+    listing order for `search`.
+    """
+
+    def __init__(self, records: Iterable[WorkspaceRecord] = ()):
+        self.records: list[WorkspaceRecord] = []
+        self.by_id: dict[str, int] = {}
+        self.by_name: dict[str, list[str]] = {}
+        self.names: list[str] = []
+        self.selected: set[str] = set()
+        self.replace(records)
+
+    def replace(self, records: Iterable[WorkspaceRecord]) -> None:
+        """Show `records` instead, keeping the selection of ids still present."""
+        self.records = list(records)
+        self.by_id = {}
+        self.by_name = {}
+        for idx, record in enumerate(self.records):
+            self.by_id[record.id] = idx
+            self.by_name.setdefault(record.name, []).append(record.id)
+        self.names = [record.name.lower() for record in self.records]
+        self.selected &= self.by_id.keys()
+
+    def update(self, record: WorkspaceRecord) -> bool:
+        """Replace the record with the same id, if it is listed."""
+        idx = self.by_id.get(record.id)
+        if idx is None:
+            return False
+        old = self.records[idx]
+        if old.name != record.name:
+            self.by_name[old.name].remove(old.id)
+            if not self.by_name[old.name]:
+                del self.by_name[old.name]
+            self.by_name.setdefault(record.name, []).append(record.id)
+            self.names[idx] = record.name.lower()
+        self.records[idx] = record
+        return True
+
+    def apply(self, changes: Iterable[Change]) -> bool:
+        """Merge `changes` in place: changed records are replaced where they
+        are, added ones go at the end and removed ones are dropped, along with
+        their selection. Returns whether rows were added or removed."""
+        removed = set()
+        moved = False
+        for change in changes:
+            record = change.record
+            if change.kind == "removed":
+                removed.add(record.id)
+            elif not self.update(record):
+                self.by_id[record.id] = len(self.records)
+                self.by_name.setdefault(record.name, []).append(record.id)
+                self.records.append(record)
+                self.names.append(record.name.lower())
+                moved = True
+        removed &= self.by_id.keys()
+        if removed:
+            self.replace(record for record in self.records if record.id not in removed)
+        return moved or bool(removed)
+
+    def get(self, workspace_id: str) -> Optional[WorkspaceRecord]:
+        idx = self.by_id.get(workspace_id)
+        return None if idx is None else self.records[idx]
+
+    def search(self, query: str, within: Optional[Iterable[int]] = None) -> list[int]:
+        """Positions of the workspaces whose name contains `query`, ignoring case.
+
+        Pass the result for a shorter query as `within` to only look at the
+        workspaces that matched before, as the query grows while typing.
+        """
+        query = query.lower()
+        names = self.names
+        if within is None:
+            return [idx for idx, name in enumerate(names) if query in name]
+        return [idx for idx in within if query in names[idx]]
+
+    def named(self, name: str) -> list[WorkspaceRecord]:
+        """All workspaces called `name`; names are not unique."""
+        return [self.records[self.by_id[i]] for i in self.by_name.get(name, ())]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[WorkspaceRecord]:
+        return iter(self.records)
+
+    def __getitem__(self, idx: int) -> WorkspaceRecord:
+        return self.records[idx]
+
+    def __contains__(self, workspace_id: str) -> bool:
+        return workspace_id in self.by_id
+
+    def toggle(self, workspace_id: str) -> None:
+        if workspace_id in self.selected:
+            self.selected.discard(workspace_id)
+        elif workspace_id in self.by_id:
+            self.selected.add(workspace_id)
+
+    def toggle_all(self, ids: Optional[Iterable[str]] = None) -> None:
+        """Select every workspace in `ids` (default all of them), or unselect
+        them if all of them are selected already."""
+        ids = set(self.by_id) if ids is None else set(ids)
+        if ids <= self.selected:
+            self.selected -= ids
+        else:
+            self.selected |= ids
+
+    def selection(self) -> list[WorkspaceRecord]:
+        """The selected workspaces, in listing order."""
+        return [record for record in self.records if record.id in self.selected]
+
+
+def matching(
+    workspaces: Iterable,
+    match: Optional[str] = None,
+    ids: Optional[Iterable[str]] = None,
+    user: Optional[str] = None,
+    account: Optional[str] = None,
+) -> Iterator:
+    """Workspaces whose name matches the regex `match` and contains `user`,
+    whose id is in `ids` and that were listed with `account`; criteria that
+    are not given match everything."""
+    pattern = re.compile(match) if match else None
+    ids = set(ids) if ids else None
+    for vm in workspaces:
+        if pattern and not pattern.search(vm.name):
+            continue
+        if ids and vm.id not in ids:
+            continue
+        if user and user not in vm.name:
+            continue
+        if account is not None and vm.account != account:
+            continue
+        yield vm
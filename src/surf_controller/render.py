@@ -0,0 +1,80 @@
+import curses
+from typing import Optional
+
+# A line of the screen: its text and curses attributes
+Line = tuple[str, int]
+
+
+class Screen:
+    """Differential renderer for the controller.
+
+    The VM list lives in a pad that holds every row, the footer (help text,
+    logs and status line) in a window below it. Both remember what they drew
+    last, only lines whose text or attributes changed are written again, and
+    the terminal is updated once per frame with `doupdate`.
+    """
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.pad = None
+        self.footer = None
+        self.layout: Optional[tuple] = None
+        self.top = 0
+        self.rows: list[Line] = []
+        self.footer_rows: list[Line] = []
+
+    def invalidate(self) -> None:
+        """Repaint everything on the next frame, e.g. after something else used the terminal."""
+        self.layout = None
+
+    def draw(self, rows: list[Line], top: int, list_height: int, footer: list[Line]) -> None:
+        max_y, max_x = self.stdscr.getmaxyx()
+        list_height = max(1, min(list_height, max_y - 1))
+        if self.layout != (max_y, max_x, list_height):
+            self.relayout(max_y, max_x, list_height)
+
+        pad_height = max(len(rows), top + list_height)
+        if pad_height > self.pad.getmaxyx()[0]:
+            self.pad.resize(pad_height, max_x)
+
+        self.update(self.pad, self.rows, rows, max_x - 1)
+        self.update(self.footer, self.footer_rows, footer[: max_y - list_height], max_x - 1)
+
+        if top != self.top:
+            # the pad scrolled, so every visible line has to be copied again
+            self.pad.touchwin()
+            self.top = top
+        self.pad.noutrefresh(top, 0, 0, 0, list_height - 1, max_x - 1)
+        self.footer.noutrefresh()
+        curses.doupdate()
+
+    def relayout(self, max_y: int, max_x: int, list_height: int) -> None:
+        self.layout = (max_y, max_x, list_height)
+        self.stdscr.clear()
+        self.stdscr.noutrefresh()
+        self.pad = curses.newpad(list_height, max_x)
+        self.footer = curses.newwin(max_y - list_height, max_x, list_height, 0)
+        self.top = 0
+        self.rows = []
+        self.footer_rows = []
+
+    @staticmethod
+    def update(window, previous: list[Line], current: list[Line], width: int) -> None:
+        for y, line in enumerate(current):
+            if y < len(previous) and previous[y] == line:
+                continue
+            text, attr = line
+            try:
+                window.move(y, 0)
+                window.clrtoeol()
+                if text:
+                    window.addnstr(y, 0, text, width, attr)
+            except curses.error:
+                pass
+        for y in range(len(current), len(previous)):
+            try:
+                window.move(y, 0)
+                window.clrtoeol()
+            except curses.error:
+                pass
+        previous[:] = current
@@ -0,0 +1,98 @@
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional, TextIO
+
+FORMATS = ("json", "ndjson", "csv")
+SUFFIXES = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "json"}
+
+
+class Output:
+    """Write records to a stream as they come in, in one of FORMATS.
+
+    With `compact`, JSON records are written without spaces.
+    """
+
+    def __init__(
+        self,
+        format: str,
+        fields: list[str],
+        stream: TextIO = sys.stdout,
+        flush: bool = True,
+        compact: bool = False,
+    ):
+        self.format = format
+        self.fields = fields
+        self.stream = stream
+        self.flush = flush
+        self.separators = (",", ":") if compact else None
+        self.count = 0
+        if format == "csv":
+            import csv
+
+            self.writer = csv.DictWriter(stream, fieldnames=fields, extrasaction="ignore")
+            self.writer.writeheader()
+        elif format == "json":
+            stream.write("[")
+
+    def write(self, record: dict) -> None:
+        if self.format == "csv":
+            self.writer.writerow(record)
+        elif self.format == "ndjson":
+            self.stream.write(json.dumps(record, separators=self.separators) + "\n")
+        else:
+            line = json.dumps(record, separators=self.separators)
+            self.stream.write(("," if self.count else "") + "\n" + line)
+        self.count += 1
+        if self.flush:
+            self.stream.flush()
+
+    def close(self) -> None:
+        if self.format == "json":
+            self.stream.write("\n]\n" if self.count else "]\n")
+        self.stream.flush()
+
+
+class Snapshot:
+    """A workspace listing written to `path` while it is being fetched.
+
+    Rows go to a temporary file next to `path`, which only replaces `path` on
+    `commit`, so readers of the file see either the previous listing or the
+    new one and never a partial one. Leaving the `with` block without a
+    commit throws the temporary file away. The format follows the suffix of
+    `path` (.csv, .ndjson/.jsonl or .json) unless it is given.
+    """
+
+    def __init__(self, path: Path, fields: list[str], format: Optional[str] = None):
+        self.path = path
+        self.format = format or SUFFIXES.get(path.suffix, "csv")
+        # A name of its own, so concurrent writers do not share the file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        self.tmp = Path(tmp)
+        # mkstemp makes it private, but the listing is for other programs
+        os.chmod(fd, 0o644)
+        self.file = os.fdopen(fd, "w", newline="")
+        self.output = Output(self.format, fields, self.file, flush=False, compact=True)
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if not self.file.closed:
+            self.discard()
+
+    def write(self, record: dict) -> None:
+        self.output.write(record)
+
+    def commit(self) -> None:
+        self.output.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def discard(self) -> None:
+        self.file.close()
+        self.tmp.unlink(missing_ok=True)
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+
+class LogTailer:
+    """Keep the last lines of a growing log file.
+
+    Only the bytes appended since the previous read are read. A file that
+    shrank is read again from the start, and a file that was replaced (by log
+    rotation) is detected by its inode.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        lines: int = 10,
+        changed: Optional[threading.Event] = None,
+        poll: float = 5.0,
+    ):
+        self.path = path
+        self.lines: deque = deque(maxlen=lines)
+        # set by the logger whenever this process writes a record; `poll` is
+        # the fallback for writes from other processes
+        self.changed = changed or threading.Event()
+        self.poll = poll
+        self.inode: Optional[int] = None
+        self.offset = 0
+        self.partial = ""
+
+    def read(self) -> bool:
+        """Read whatever was appended since the last call; returns whether there was any."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+
+        skip_first = False
+        if stat.st_ino != self.inode:
+            first = self.inode is None
+            self.inode = stat.st_ino
+            self.offset = 0
+            self.partial = ""
+            if first and stat.st_size > 16384:
+                # On the first read only look at the end of a large file
+                self.offset = stat.st_size - 16384
+                skip_first = True
+        elif stat.st_size < self.offset:
+            self.offset = 0
+            self.partial = ""
+        if stat.st_size == self.offset:
+            return False
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+            self.offset = f.tell()
+
+        text = self.partial + data.decode("utf-8", errors="replace")
+        *complete, self.partial = text.split("\n")
+        if skip_first:
+            # the tail starts in the middle of a line
+            complete = complete[1:]
+        self.lines.extend(complete)
+        return bool(complete)
+
+    def follow(self, on_change: Callable[[list], None]) -> None:
+        if self.read():
+            on_change(list(self.lines))
+        while True:
+            self.changed.wait(self.poll)
+            self.changed.clear()
+            if self.read():
+                on_change(list(self.lines))
@@ -1,45 +1,237 @@
+import atexit
+import json
 import logging
+import os
+import queue
 import sys
+import threading
 import tomllib
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Any, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, where an open log file cannot be renamed anyway
+    fcntl = None
+
+DEFAULT_CONFIG = Path(__file__).parent / "config.toml"
+
+
+def merge_config(defaults: dict, overrides: dict) -> dict:
+    merged = dict(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
 
 
 def get_config(configfile=Path.home() / ".surf_controller/config.toml"):
+    # The user config is a copy of an older default, so fill in any keys
+    # that were added to the packaged config since it was created.
+    with open(DEFAULT_CONFIG, "rb") as f:
+        defaults = tomllib.load(f)
+    if not configfile.exists():
+        return defaults
     with open(configfile, "rb") as f:
-        return tomllib.load(f)
+        return merge_config(defaults, tomllib.load(f))
+
+
+def read_text(path: Path) -> Optional[str]:
+    if not path.exists():
+        return None
+    return path.read_text().strip()
 
 
-def setup_logger(log_file=Path.home() / ".surf_controller/logs.log", use_curses=True):
+class Config:
+    """The user configuration and the files it points to, loaded on first use.
+
+    Every file is cached together with its modification time and only read
+    again once that changes, so the config and the token files can be looked
+    up as often as needed and edits on disk are still picked up.
+    """
+
+    def __init__(self, configfile=Path.home() / ".surf_controller/config.toml"):
+        self.configfile = configfile
+        self.cache: dict = {}
+        self.lock = threading.Lock()
+
+    def cached(self, path: Path, reader: Callable[[Path], Any]) -> Any:
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self.lock:
+            hit = self.cache.get(path)
+            if hit is not None and hit[0] == mtime:
+                return hit[1]
+        value = reader(path)
+        with self.lock:
+            self.cache[path] = (mtime, value)
+        return value
+
+    def load(self) -> dict:
+        return self.cached(self.configfile, get_config)
+
+    def __getitem__(self, key: str):
+        return self.load()[key]
+
+    def get(self, key: str, default=None):
+        return self.load().get(key, default)
+
+    @property
+    def scriptdir(self) -> Path:
+        return Path.home() / self["files"]["scriptdir"]
+
+    def accounts(self) -> list[str]:
+        """Names of the `[accounts]` tables, or [""] for the tokens in [files]."""
+        return list(self.get("accounts", {})) or [""]
+
+    def read(self, name: str, account: str = "") -> Optional[str]:
+        """Contents of the file configured as `name` in [files], e.g. "api-token",
+        or in the `[accounts.<account>]` table."""
+        files = self["accounts"][account] if account else self["files"]
+        return self.cached(self.scriptdir / files[name], read_text)
+
+
+class NotifyHandler(logging.Handler):
+    """Sets an event for every record, so readers of the log file can wake up."""
+
+    def __init__(self, event: threading.Event):
+        super().__init__()
+        self.event = event
+
+    def emit(self, record):
+        self.event.set()
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """A RotatingFileHandler for a file that several processes write.
+
+    The TUI, the daemon and CLI runs all log to logs.log. Every record goes
+    to the file at the path, reopened when another process rotated it, like
+    WatchedFileHandler does; and the file is rotated under a lock on
+    `<file>.lock`, once per time it fills up, by whichever process sees it
+    full first.
+    """
+
+    def reopen_if_rotated(self) -> None:
+        if self.stream is None:
+            return
+        try:
+            st = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            st = None
+        current = os.fstat(self.stream.fileno())
+        if st is None or (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino):
+            self.stream.close()
+            self.stream = self._open()
+
+    def emit(self, record):
+        self.reopen_if_rotated()
+        super().emit(record)
+
+    def doRollover(self):
+        if fcntl is None:
+            super().doRollover()
+            return
+        with open(self.baseFilename + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have rotated it while this one waited
+            stream = self.stream
+            self.reopen_if_rotated()
+            if self.stream is stream:
+                super().doRollover()
+
+
+# Attributes of every log record, anything else was passed with `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, source and message, plus the
+    fields passed with `extra`, e.g. workspace_id, action, status, latency."""
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+# Set whenever the logger has written a record to the log file
+log_written = threading.Event()
+
+
+def setup_logger(
+    log_file=Path.home() / ".surf_controller/logs.log",
+    use_curses=True,
+    max_bytes=None,
+    backups=None,
+):
     """
     Sets up a logger that prints useful information such as filename, line number, and time.
     The logger will save logs to a specified log file, and optionally output to console if not in curses mode.
 
     :param log_file: The name of the log file where logs should be saved (default is '.surf_controller/logs.log' in user's home directory)
     :param use_curses: Boolean flag to indicate if the script is running in curses mode
+    :param max_bytes: Size at which the log file is rotated (default from [logging] in the config)
+    :param backups: Number of rotated log files to keep (default from [logging] in the config)
     :return: Configured logger instance
+
+    The handlers run on a background thread: logging a message only puts the
+    record on a queue. Messages are %-style, so they are only formatted for
+    records that pass the level.
     """
     # Create a custom logger
     logger = logging.getLogger(__name__)
 
     # Set the minimum logging level
-    logger.setLevel(logging.INFO)
+    level = logging.getLevelName(config["logging"]["level"].upper())
+    logger.setLevel(level)
+    if logger.handlers:
+        # already set up by an earlier call
+        return logger
+    if max_bytes is None:
+        max_bytes = config["logging"]["max-bytes"]
+    if backups is None:
+        backups = config["logging"]["backups"]
 
     # Ensure the directory for the log file exists
     log_file.parent.mkdir(parents=True, exist_ok=True)
 
     # Create and set up the file handler
-    f_handler = logging.FileHandler(log_file)
-    f_handler.setLevel(logging.INFO)
+    f_handler = SharedRotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups)
+    f_handler.setLevel(level)
     f_formatter = logging.Formatter(
         "%(asctime)s - %(filename)s - %(lineno)d - %(levelname)s - %(message)s"
     )
     f_handler.setFormatter(f_formatter)
-    logger.addHandler(f_handler)
+    handlers = [f_handler, NotifyHandler(log_written)]
+
+    if config["logging"]["json"]:
+        j_handler = SharedRotatingFileHandler(
+            log_file.parent / config["logging"]["json"],
+            maxBytes=max_bytes,
+            backupCount=backups,
+        )
+        j_handler.setLevel(level)
+        j_handler.setFormatter(JsonFormatter())
+        handlers.append(j_handler)
 
     if not use_curses:
         # Only add console handler if not in curses mode
         c_handler = logging.StreamHandler(sys.stdout)
-        c_handler.setLevel(logging.INFO)
+        c_handler.setLevel(level)
 
         # Define ANSI color codes
         RESET = "\033[0m"
@@ -55,17 +247,25 @@ def setup_logger(log_file=Path.home() / ".surf_controller/logs.log", use_curses=
             def format(self, record):
                 record.asctime = self.formatTime(record, self.datefmt)
                 log_color = COLOR_MAP.get(record.levelno, RESET)
-                log_msg = f"{log_color}{record.asctime} - {record.filename} - {record.lineno} - {record.levelname} - {RESET}{record.msg}"
+                log_msg = f"{log_color}{record.asctime} - {record.filename} - {record.lineno} - {record.levelname} - {RESET}{record.getMessage()}"
                 return log_msg
 
         c_formatter = CustomFormatter(
             "%(asctime)s - %(filename)s - %(lineno)d - %(levelname)s - %(message)s"
         )
         c_handler.setFormatter(c_formatter)
-        logger.addHandler(c_handler)
+        handlers.append(c_handler)
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # Write out what is still queued when the program exits
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(records))
 
     return logger
 
 
-config = get_config()
-logger = setup_logger()
+config = Config()
+# Handlers are attached by setup_logger, which the entry points call
+logger = logging.getLogger(__name__)
@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from surf_controller.api import Workspace
+from surf_controller.registry import WorkspaceRecord
+from surf_controller.utils import config, logger
+
+
+@dataclass
+class Transition:
+    id: str
+    name: str
+    settled: bool
+    elapsed: float
+    workspace: Optional[WorkspaceRecord] = None
+
+
+class Waiter:
+    """Poll a set of workspaces until their `active` flag reaches a target state.
+
+    Only the given workspaces are requested, each round in parallel, and the
+    delay between rounds grows from `interval` up to `max_interval`.
+    """
+
+    def __init__(
+        self,
+        workspace: Workspace,
+        timeout: Optional[float] = None,
+        interval: Optional[float] = None,
+        max_interval: Optional[float] = None,
+    ):
+        self.workspace = workspace
+        self.timeout = timeout or config["wait"]["timeout"]
+        self.interval = interval or config["wait"]["interval"]
+        self.max_interval = max_interval or config["wait"]["max-interval"]
+        self.concurrency = config["action"]["concurrency"]
+        self.stopping = threading.Event()
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def __call__(
+        self,
+        vms: list,
+        active: bool,
+        on_settled: Optional[Callable[[Transition], None]] = None,
+    ) -> list[Transition]:
+        pending = {vm.id: vm for vm in vms}
+        transitions = []
+        if not pending:
+            return transitions
+
+        def report(transition: Transition) -> None:
+            transitions.append(transition)
+            if on_settled:
+                on_settled(transition)
+
+        start = time.monotonic()
+        interval = self.interval
+        workers = min(self.concurrency, len(pending))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending:
+                ids = list(pending)
+                for vm_id, current in zip(ids, pool.map(self.workspace.get_workspace, ids)):
+                    if current is not None and current.active == active:
+                        elapsed = time.monotonic() - start
+                        logger.info(
+                            "%s | %s | active: %s after %.1fs",
+                            current.name, vm_id, active, elapsed,
+                            extra={"workspace_id": vm_id, "workspace": current.name, "latency": elapsed},
+                        )
+                        del pending[vm_id]
+                        report(Transition(vm_id, current.name, True, elapsed, current))
+
+                elapsed = time.monotonic() - start
+                if pending and elapsed >= self.timeout:
+                    for vm_id, vm in pending.items():
+                        logger.warning(
+                            "%s | %s | still not active: %s after %.1fs",
+                            vm.name, vm_id, active, elapsed,
+                            extra={"workspace_id": vm_id, "workspace": vm.name, "latency": elapsed},
+                        )
+                        report(Transition(vm_id, vm.name, False, elapsed))
+                    break
+                if pending:
+                    if self.stopping.wait(min(interval, self.timeout - elapsed)):
+                        break
+                    interval = min(interval * 1.5, self.max_interval)
+        return transitions
@@ -0,0 +1,53 @@
+import queue
+import threading
+from typing import Callable, Optional
+
+from surf_controller.metrics import profiler
+from surf_controller.utils import logger
+
+
+class Worker:
+    """Run slow work off the UI thread.
+
+    Jobs are picked up by a small set of daemon threads. Anything a job wants
+    to change in the UI is posted back as an event, and the UI thread applies
+    the events with `drain` between keystrokes, so curses is only ever touched
+    from one thread.
+    """
+
+    def __init__(self, threads: int = 2):
+        self.jobs: queue.Queue = queue.Queue()
+        self.events: queue.Queue = queue.Queue()
+        for _ in range(threads):
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(
+        self, fn: Callable, *args, on_done: Optional[Callable] = None
+    ) -> None:
+        self.jobs.put((fn, args, on_done))
+
+    def post(self, callback: Callable, *args) -> None:
+        """Queue `callback(*args)` to run on the UI thread."""
+        self.events.put((callback, args))
+
+    def drain(self) -> bool:
+        """Apply all queued events; returns whether there were any."""
+        drained = False
+        while True:
+            try:
+                callback, args = self.events.get_nowait()
+            except queue.Empty:
+                return drained
+            callback(*args)
+            drained = True
+
+    def run(self) -> None:
+        while True:
+            fn, args, on_done = self.jobs.get()
+            try:
+                with profiler.thread():
+                    result = fn(*args)
+                if on_done:
+                    self.post(on_done, result)
+            except Exception:
+                logger.exception("Background job %s failed", fn.__name__)